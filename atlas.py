@@ -0,0 +1,26 @@
+import numpy as np
+
+def pack(images, width=1024):
+    # pack images {name: [w, h, RGBA data from the bottom line]} side by side on shelves
+    # returns the data of the whole texture and the (u0, v0, u1, v1) rectangle of every image
+    places = {}
+    x = y = shelf = 0
+    for name in sorted(images, key=lambda name: -images[name][1]): # highest first
+        w, h = images[name][0]+2, images[name][1]+2 # 1 pixel border
+        if x+w > width: # next shelf
+            x, y, shelf = 0, y+shelf, 0
+        places[name] = (x, y)
+        x += w
+        shelf = max(shelf, h)
+    height = y+shelf
+
+    data = np.zeros((height, width, 4), np.uint8)
+    rects = {}
+    for name, (x, y) in places.items():
+        w, h, pixels = images[name]
+        pixels = np.frombuffer(pixels, np.uint8).reshape(h, w, 4)
+        # repeat the edges in the border to never sample the neighbors
+        data[y:y+h+2, x:x+w+2] = np.pad(pixels, ((1, 1), (1, 1), (0, 0)), 'edge')
+        rects[name] = ((x+1)/width, (y+1)/height, (x+1+w)/width, (y+1+h)/height)
+
+    return data, rects
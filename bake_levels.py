@@ -0,0 +1,18 @@
+import sys
+
+from level import *
+
+# usage: bake_levels.py seed [count] [workers]
+# generates the first count levels (10 by default) of the games started with seed in files/levels
+# workers: gen_workers of files/options.txt (1 by default), the tiles are generated one after the other
+# the game reads them instead of generating them again when level_cache is enabled in files/options.txt
+
+seed = int(sys.argv[1])
+count = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+workers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+max_wall = 4 # number of walls textures of the game
+
+for number in range(1, count+1):
+    m, n = level_size(number)
+    cached_level(m, n, max_wall, level_seed(seed, number), level_tile(m, n, workers))
+print('%d levels in %s' %(count, LEVELS))
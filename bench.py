@@ -0,0 +1,159 @@
+import os
+import sys
+import tempfile
+import tracemalloc
+
+from time import perf_counter
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+
+from maze import *
+from mesh import *
+from level import *
+from headless import *
+from brains import Brain
+
+# usage: bench.py [sizes...], each size being the number of lines and columns of the maze
+# the levels built and simulated headlessly use smaller sizes, like the game does
+# every maze is made from its size as seed, to compare the same mazes across versions
+sizes = [int(arg) for arg in sys.argv[1:]] or [10, 100, 500, 1000, 2000]
+levels = [10, 30, 100]
+tiled = [1000, 2000] # mazes generated by tiles
+monsters = [0, 50, 200]
+
+def timed(function, *args):
+    # returns the result and the time taken (s)
+    start = perf_counter()
+    result = function(*args)
+    return result, perf_counter()-start
+
+def peak(function, *args):
+    # peak memory used (bytes), measured apart as tracing slows everything down
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+print('%-11s %10s %10s %10s %10s' %('maze', 'gen (s)', 'blocks (s)', 'gen (MB)', 'blocks (MB)'))
+for size in sizes:
+    maze, gen_time = timed(gen, size, size, Random(size))
+    _, blocks_time = timed(to_blocks, maze, 4, np.random.default_rng(size))
+    gen_peak, blocks_peak = peak(gen, size, size), peak(to_blocks, maze, 4)
+    print('%-11s %10.3f %10.3f %10.2f %10.2f' %('%dx%d' %(size, size), gen_time, blocks_time,
+                                               gen_peak/1e6, blocks_peak/1e6))
+
+# tiles generated by 1 to all the cores, against gen (workers: 0)
+# forked workers, as spawned ones would run this file again
+print()
+print('%-11s %10s %10s %10s' %('tiled', 'workers', 'time (s)', 'speedup'))
+for size in tiled:
+    _, serial_time = timed(gen, size, size, Random(size))
+    print('%-11s %10d %10.3f %10.2f' %('%dx%d' %(size, size), 0, serial_time, 1))
+    for workers in sorted({1, 2, 4, os.cpu_count()}):
+        with ProcessPoolExecutor(workers, get_context('fork')) as executor:
+            list(executor.map(gen_tile, [(1, 1, 0)]*workers)) # start the processes
+            _, tiled_time = timed(gen_tiled, size, size, Random(size), TILE, executor)
+        print('%-11s %10d %10.3f %10.2f' %('%dx%d' %(size, size), workers, tiled_time, serial_time/tiled_time))
+
+def stream(n, m):
+    # consume a streamed maze without keeping it
+    for row in to_blocks_rows(gen_rows(n, m, Random(n)), 4, np.random.default_rng(n)):
+        pass
+
+print()
+print('%-11s %10s %10s' %('streamed', 'time (s)', 'peak (MB)'))
+for size in sizes:
+    _, stream_time = timed(stream, size, size)
+    print('%-11s %10.3f %10.2f' %('%dx%d' %(size, size), stream_time, peak(stream, size, size)/1e6))
+
+def mesh(level):
+    # the level geometry built in make_maze, with a dummy atlas
+    quads, tex, names, lights = level_quads(level.maze, walls_names, level.flats)
+    return split(to_atlas(quads, tex, names, {name: (0, 0, 1, 1) for name in names}), level.maze.shape)
+
+print()
+print('%-11s %10s %10s %10s' %('mesh', 'time (s)', 'peak (MB)', 'chunks'))
+for size in levels:
+    level = gen_level(size, size, 4, size)
+    chunks, mesh_time = timed(mesh, level)
+    print('%-11s %10.3f %10.2f %10d' %('%dx%d' %(size, size), mesh_time, peak(mesh, level)/1e6, len(chunks)))
+
+# a level generated again against read from the cache
+path = os.path.join(tempfile.mkdtemp(), 'bench.level')
+print()
+print('%-11s %10s %10s %10s %10s' %('level', 'gen (s)', 'save (s)', 'load (s)', 'file (kB)'))
+for size in levels:
+    level, gen_time = timed(gen_level, size, size, 4, size)
+    _, save_time = timed(save_level, level, path)
+    _, load_time = timed(load_level, path)
+    print('%-11s %10.4f %10.4f %10.4f %10.1f' %('%dx%d' %(size, size), gen_time, save_time, load_time,
+                                                os.path.getsize(path)/1e3))
+os.remove(path)
+
+def spawn(count, shared):
+    # the monsters of a level, with their sounds shared or decoded again for every monster as before
+    entities.sounds.clear()
+    monsters = []
+    for _ in range(count):
+        monsters.append(Monster(Vector3(0.5, 0, 0.5), 'SoldierGun', 50))
+        if not shared:
+            entities.sounds.clear()
+    return monsters
+
+pygame.mixer.init()
+entities.audio = True
+send_tex({'SoldierGun': {}})
+print()
+print('%-11s %10s %10s %10s %10s' %('spawn', 'monsters', 'time (s)', 'us/spawn', 'sfx (MB)'))
+for shared in [False, True]:
+    for count in [10, 100]:
+        spawned, spawn_time = timed(spawn, count, shared)
+        samples = {id(sound): sound for monster in spawned for sound in monster.sounds.values()}
+        print('%-11s %10d %10.3f %10.1f %10.2f' %(['decoded', 'shared'][shared], count, spawn_time,
+                                                spawn_time/count*1e6, sum(len(sound.get_raw()) for sound in samples.values())/1e6))
+entities.sounds.clear()
+entities.channels.clear()
+
+def collide_all(game, count):
+    # make every entity solve its collisions count times
+    for _ in range(count):
+        for entity in game.entities:
+            entity.collide()
+
+print()
+print('%-11s %10s %10s %10s' %('collide', 'monsters', 'time (s)', 'us/call'))
+for size in levels:
+    for count in monsters:
+        game = Game(size, size, count, seed=size)
+        _, collide_time = timed(collide_all, game, 100)
+        print('%-11s %10d %10.3f %10.2f' %('%dx%d' %(size, size), count, collide_time,
+                                           collide_time/100/len(game.entities)*1e6))
+
+stages = ['player', 'monsters', 'bullets', 'particles', 'doors']
+print()
+# time spent in every stage of a tick (ms)
+print('%-11s %10s %10s' %('tick', 'monsters', 'ticks/s') + ''.join(' %10s' %stage for stage in stages))
+profiler.enabled = True
+for size in levels:
+    for count in monsters:
+        game = Game(size, size, count, seed=size)
+        profiler.reset()
+        run_time = game.run(600)
+        print('%-11s %10d %10.0f' %('%dx%d' %(size, size), count, 600/run_time)
+              + ''.join(' %10.3f' %(profiler.spans.get(stage, 0)/600*1e3) for stage in stages))
+
+print()
+# the same with the monsters decisions made in another process, brain: time waiting for them (ms)
+print('%-11s %10s %10s %10s %10s' %('brain', 'monsters', 'ticks/s', 'monsters', 'brain'))
+brain = Brain()
+send_brain(brain)
+for size in levels:
+    for count in monsters:
+        game = Game(size, size, count, seed=size)
+        profiler.reset()
+        run_time = game.run(600)
+        print('%-11s %10d %10.0f %10.3f %10.3f' %('%dx%d' %(size, size), count, 600/run_time,
+              profiler.spans.get('monsters', 0)/600*1e3, profiler.spans.get('brain', 0)/600*1e3))
+brain.stop()
+send_brain(None)
@@ -0,0 +1,71 @@
+import ctypes
+import numpy as np
+
+from OpenGL.GL import *
+
+UV = [(0, 0), (1, 0), (1, 1), (0, 1)]
+
+class Billboards:
+    # vertical quads gathered during a frame (monster sprites, doors), drawn from one vertex buffer
+    # every texture (sprite sheet) is drawn with one call, its quads sorted back-to-front
+    def __init__(self):
+        self.textures = [] # of every quad
+        self.quads = [] # x, y, z (bottom middle), half width vector (x, z), height, (u0, v0, u1, v1) and normal (x, z)
+        self.buffer = None # made once OpenGL is ready
+        self.size = 0 # of the buffer, in bytes
+
+    def add(self, texture, rect, pos, v, height, normal):
+        # pos: bottom middle of the quad, v: from pos to the bottom right corner (horizontal)
+        self.textures.append(texture)
+        self.quads.append((pos[0], pos[1], pos[2], v[0], v[2], height, *rect, normal[0], normal[2]))
+
+    def vertices(self, eye):
+        # GL_T2F_N3F_V3F vertices of the quads, sorted by texture then back-to-front
+        # returns them with the (texture, first vertex, count) of every texture
+        quads = np.array(self.quads, np.float32)
+        textures = np.array(self.textures)
+        distance = ((quads[:, :3] - eye)**2).sum(1)
+        order = np.lexsort([-distance, textures])
+        quads, textures = quads[order], textures[order]
+
+        vertices = np.zeros((len(quads), 4, 8), np.float32)
+        for corner, (s, t) in enumerate(UV):
+            vertices[:, corner, 0] = quads[:, 6+2*s] # u0 or u1
+            vertices[:, corner, 1] = quads[:, 7+2*t] # v0 or v1
+            vertices[:, corner, 5] = quads[:, 0] + (2*s-1)*quads[:, 3]
+            vertices[:, corner, 6] = quads[:, 1] + t*quads[:, 5]
+            vertices[:, corner, 7] = quads[:, 2] + (2*s-1)*quads[:, 4]
+        vertices[:, :, 2] = quads[:, None, 10]
+        vertices[:, :, 4] = quads[:, None, 11]
+
+        starts = np.flatnonzero(np.diff(textures, prepend=-1))
+        counts = np.diff(np.append(starts, len(quads)))
+        return vertices, [(int(textures[start]), int(start)*4, int(count)*4) for start, count in zip(starts, counts)]
+
+    def render(self, eye):
+        # draw and forget the quads of the frame
+        if not self.quads:
+            return
+        vertices, draws = self.vertices(tuple(eye))
+        self.textures, self.quads = [], []
+
+        if self.buffer is None:
+            self.buffer = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.buffer)
+        if vertices.nbytes > self.size: # grow the buffer, else reuse it
+            self.size = vertices.nbytes*2
+            glBufferData(GL_ARRAY_BUFFER, self.size, None, GL_STREAM_DRAW)
+        glBufferSubData(GL_ARRAY_BUFFER, 0, vertices.nbytes, vertices)
+
+        # fully transparent pixels must not hide the quads of other textures drawn after them
+        glEnable(GL_ALPHA_TEST)
+        glAlphaFunc(GL_GREATER, 0)
+        glInterleavedArrays(GL_T2F_N3F_V3F, 0, ctypes.c_void_p(0))
+        for texture, first, count in draws:
+            glBindTexture(GL_TEXTURE_2D, texture)
+            glDrawArrays(GL_QUADS, first, count)
+        glDisable(GL_ALPHA_TEST)
+
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        for array in [GL_VERTEX_ARRAY, GL_NORMAL_ARRAY, GL_TEXTURE_COORD_ARRAY]:
+            glDisableClientState(array)
@@ -0,0 +1,166 @@
+import numpy as np
+
+from random import seed
+from multiprocessing import get_context, resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from pygame.math import Vector3
+
+import entities
+from entities import Mind, FlowField
+
+# the decisions of the monsters (Mind.think) made in another process while this one renders the frame
+# shared memory: the world (player, time), the state of every monster (one line each) and the blocks of the level
+
+PX, PY, PZ, DYING, NOW, BLOCKS = range(6) # world, BLOCKS: changed every time a door opens or closes
+WORLD = 6
+
+# columns of the monsters: their state, the actions decided since they were last updated
+# and whether they were updated since the last decisions
+X, Y, Z, ROT, TYPE, LAST_SHOT, DELAY, START_SEE, SEE, SEE_X, SEE_Y, SEE_Z, \
+    GOAL, GOAL_X, GOAL_Y, GOAL_Z, GOAL_WHEN, MOVE_X, MOVE_Y, MOVE_Z, ACTIONS, DUE = range(22)
+FIELDS = 22
+
+def views(buffer, count, shape):
+    # world, monsters and blocks arrays over the shared memory
+    world = np.ndarray(WORLD, np.float64, buffer)
+    states = np.ndarray((count, FIELDS), np.float64, buffer, world.nbytes)
+    maze = np.ndarray(shape, np.int8, buffer, world.nbytes+states.nbytes)
+    return world, states, maze
+
+def store(mind, row):
+    # everything the decisions need about a monster, in its line
+    see = mind.last_see or (0, 0, 0)
+    goal, when = mind.walk_goal or ((0, 0, 0), 0)
+    row[:ACTIONS] = [*mind.pos, mind.rot.y, mind.type_, mind.last_shot, mind.weapon_delay, mind.start_see,
+                     mind.last_see is not None, *see, mind.walk_goal is not None, *goal, when, *mind.movement]
+
+def decide(mind, row):
+    # the decisions in the line of a monster: its movement and rotation, what it remembers
+    values = row.tolist()
+    mind.rot.y, mind.start_see = values[ROT], values[START_SEE]
+    mind.last_see = Vector3(values[SEE_X:SEE_Z+1]) if values[SEE] else None
+    mind.walk_goal = [Vector3(values[GOAL_X:GOAL_Z+1]), values[GOAL_WHEN]] if values[GOAL] else None
+    mind.movement = Vector3(values[MOVE_X:MOVE_Z+1])
+    return values
+
+class Seen:
+    # what the decisions need to know about the player
+    def __init__(self):
+        self.pos = Vector3()
+        self.dying = 0
+
+def think_loop(conn):
+    # in the other process: decide for the monsters updated during the step, each time the main process asks to
+    seed() # not the same random numbers as the main process
+    player = entities.player = Seen()
+    entities.ticks = lambda: now
+    shared, now = None, 0
+
+    while True:
+        message = conn.recv()
+        if message is None: # game closed
+            break
+
+        if type(message) is tuple: # new level: name of the shared memory, number of monsters, blocks shape
+            name, count, shape = message
+            world = states = entities.maze = None # the memory can't be closed while used
+            if shared is not None:
+                shared.close()
+            shared = SharedMemory(name)
+            world, states, entities.maze = views(shared.buf, count, shape)
+            entities.sight, entities.flow = {}, FlowField()
+            minds = [Mind(Vector3()) for _ in range(count)]
+            blocks = world[BLOCKS]
+            continue
+
+        now = world[NOW]
+        if world[BLOCKS] != blocks: # a door opened or closed
+            blocks = world[BLOCKS]
+            entities.sight.clear()
+            entities.flow.root = None
+        player.pos.update(*world[PX:PZ+1])
+        player.dying = world[DYING]
+        entities.flow.update(player.pos)
+
+        for mind, row in zip(minds, states):
+            if row[DUE] and row[TYPE] < 5: # not dying
+                row[DUE] = 0
+                values = decide(mind, row)
+                mind.pos.update(values[X:Z+1])
+                mind.type_, mind.last_shot, mind.weapon_delay = values[TYPE], values[LAST_SHOT], values[DELAY]
+                actions = mind.think()
+                store(mind, row)
+                row[ACTIONS] = int(values[ACTIONS]) | actions # until the monster is updated
+        conn.send(True)
+
+    world = states = entities.maze = None
+    if shared is not None:
+        shared.close()
+
+class Brain:
+    # main process side: every step of the simulation, the monsters updated during the step send their state,
+    # and the decisions made from it are used at their next update (one step later near the player)
+    def __init__(self):
+        context = get_context('fork') # raises ValueError without fork (Windows)
+        resource_tracker.ensure_running() # shared with the other process, that only attaches to the memory
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=think_loop, args=(child,), daemon=True)
+        self.process.start()
+        self.shared = None
+        self.busy = False # deciding
+
+    def level(self, maze, monsters):
+        # new level: its blocks (with the doors closed) and its monsters, that get their line
+        self.close()
+        self.shared = SharedMemory(create=True, size=8*WORLD + 8*FIELDS*len(monsters) + maze.size)
+        self.world, self.states, self.maze = views(self.shared.buf, len(monsters), maze.shape)
+        self.world[:] = 0
+        self.maze[:] = maze
+        for row, monster in enumerate(monsters):
+            monster.row = row
+            store(monster, self.states[row])
+            self.states[row, ACTIONS:] = 0
+        self.conn.send((self.shared.name, len(monsters), maze.shape))
+
+    def block(self, x, z, value):
+        self.wait()
+        self.maze[z][x] = value
+        self.world[BLOCKS] += 1
+
+    def give(self, monster):
+        # after its update
+        row = self.states[monster.row]
+        store(monster, row)
+        row[DUE] = 1
+
+    def take(self, monster):
+        # during its update: its decisions, returns the actions decided since its last update
+        row = self.states[monster.row]
+        actions = int(decide(monster, row)[ACTIONS])
+        row[ACTIONS] = 0
+        return actions
+
+    def start(self, player, now):
+        # decide for the next step
+        self.world[PX:PZ+1] = player.pos
+        self.world[DYING], self.world[NOW] = player.dying, now
+        self.conn.send(True)
+        self.busy = True
+
+    def wait(self):
+        if self.busy:
+            self.conn.recv()
+            self.busy = False
+
+    def close(self):
+        self.wait()
+        if self.shared is not None:
+            self.world = self.states = self.maze = None
+            self.shared.close()
+            self.shared.unlink()
+            self.shared = None
+
+    def stop(self):
+        self.close()
+        self.conn.send(None)
+        self.process.join(1)
@@ -0,0 +1,19 @@
+import os
+import pygame
+
+from texpack import *
+
+# packs all the PNG textures of files/ in files/textures.pack, to run again after changing them
+# the game loads the PNGs instead when the pack is missing
+
+images = {}
+for root, dirs, files in os.walk('files'):
+    dirs.sort()
+    for file in sorted(files):
+        if file.endswith('.png'):
+            path = os.path.join(root, file).replace(os.sep, '/')
+            surf = pygame.image.load(path)
+            images[path] = [*surf.get_size(), pygame.image.tostring(surf, 'RGBA', True)]
+
+write(images)
+print('%d textures, %.1f MB' %(len(images), os.path.getsize(PACK)/1e6))
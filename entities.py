@@ -1,26 +1,190 @@
 import pygame
+import numpy as np
 
 from pygame.math import Vector2, Vector3
 
 from math import *
 from random import *
+from heapq import heappush, heappop
+from itertools import count
 from OpenGL.GL import *
 from OpenGL.GLU import *
 from pygame.locals import *
 
+from profiler import profiler
+from billboards import Billboards
+
+audio = True # without audio device, sounds and channels are silent
+keys = pygame.key.get_pressed # keyboard state, can be replaced by scripted input
+billboards = Billboards() # monsters sprites of the frame, drawn all at once
+brain = None # process making the monsters decisions, see send_brain
+impact = 10 # debris of every bullet impact
+
 def send_tex(tex): # at the very start
     global textures
     textures = tex
 
 def send_vars(*args): # at the start
-    global W, H, ticks, player, particles, bullet, move_keys, fov
-    W, H, ticks, player, particles, bullet, options = args
+    global W, H, ticks, player, particles, debris, bullet, door, move_keys, fov
+    W, H, ticks, player, particles, debris, bullet, door, options = args
     fov = options['fov']
     move_keys = [ord(char.lower()) for char in options['move_keys']]
 
 def send_lists(*args): # when changing level
-    global maze, entities
-    maze, entities = args
+    global maze, entities, doors, grid, sight, flow, scheduler
+    maze, entities, doors = args
+    grid = Grid(entities)
+    sight = {} # visibility between blocks, filled when needed
+    flow = FlowField()
+    scheduler = Scheduler(entities)
+    if brain is not None:
+        brain.level(maze, [entity for entity in entities if entity != player])
+
+def send_brain(new): # at the start, with a Brain or None to make the decisions in this process
+    global brain
+    brain = new
+
+def send_quality(*args): # when the quality of the game changes
+    global impact
+    impact, Scheduler.near = args
+
+def set_block(x, z, value): # when opening or closing doors
+    maze[z][x] = value
+    sight.clear()
+    flow.root = None # needs to be computed again
+    if brain is not None:
+        brain.block(x, z, value)
+
+frame = 0 # number of steps of the simulation
+blend = 1 # where the rendering is between the last two steps
+
+def tick(events, time_passed):
+    # one step of the game simulation, returns True once the level is finished
+    global frame
+    frame += 1
+    with profiler.span('player'):
+        player.save()
+        player.update(events, time_passed)
+    with profiler.span('monsters'):
+        scheduler.update(time_passed)
+    with profiler.span('bullets'):
+        for particle in particles:
+            particle.save()
+            particle.update(time_passed)
+    with profiler.span('particles'):
+        debris.update(time_passed)
+    with profiler.span('doors'):
+        return doors.update()
+
+def interpolate(alpha):
+    # render at alpha (0 to 1) between the last two steps of the simulation
+    global blend
+    blend = alpha
+    if player.last_eye is not None:
+        player.cam = player.last_eye[0].lerp(player.eye[0], alpha)
+        player.cam_rot = player.last_eye[1].lerp(player.eye[1], alpha)
+
+class Silent:
+    # stands in for sounds and channels when there is no audio
+    def __getattr__(self, name):
+        return lambda *args: None
+
+# shared by every entity: sounds are only read and decoded the first time they are needed
+sounds = {}
+channels = {}
+
+def sound(path):
+    if path not in sounds:
+        sounds[path] = pygame.mixer.Sound(path) if audio else Silent()
+    return sounds[path]
+
+def channel(x):
+    if x not in channels:
+        channels[x] = pygame.mixer.Channel(x) if audio else Silent()
+    return channels[x]
+
+def cast(x0, z0, x1, z1, outside=False, blocks=None):
+    # walk through every block crossed by the segment (Amanatides & Woo)
+    # returns the fraction of the segment where it enters the first solid block, None if it doesn't
+    # outside: whether out of the maze is solid, blocks: list to fill with the crossed blocks
+    m, n = len(maze[0]), len(maze)
+    x, z = floor(x0), floor(z0)
+    X, Z = floor(x1), floor(z1)
+    dx, dz = x1-x0, z1-z0
+    step_x, step_z = (1 if dx > 0 else -1), (1 if dz > 0 else -1)
+
+    # distance (in fractions of the segment) to cross one block, and to reach the next one
+    delta_x = abs(1/dx) if dx else inf
+    delta_z = abs(1/dz) if dz else inf
+    next_x = ((x+1 - x0) if dx > 0 else (x0 - x)) * delta_x
+    next_z = ((z+1 - z0) if dz > 0 else (z0 - z)) * delta_z
+
+    def solid(x, z):
+        if 0 <= x < m and 0 <= z < n:
+            return maze[z][x] > 0
+        return outside
+
+    fraction = 0
+    while True:
+        if blocks is not None:
+            blocks.append((x, z))
+        if solid(x, z):
+            return fraction
+        if (x, z) == (X, Z) or min(next_x, next_z) > 1:
+            return None
+
+        if next_x < next_z:
+            fraction = next_x
+            x += step_x
+            next_x += delta_x
+        elif next_z < next_x:
+            fraction = next_z
+            z += step_z
+            next_z += delta_z
+        else: # exactly through a corner: blocked by any of the 2 blocks around
+            fraction = next_x
+            if solid(x+step_x, z) or solid(x, z+step_z):
+                return fraction
+            x += step_x
+            z += step_z
+            next_x += delta_x
+            next_z += delta_z
+
+def line_of_sight(x0, z0, x1, z1):
+    return cast(x0, z0, x1, z1) is None
+
+def raycast(start, end, *ignore):
+    # first thing hit by the segment from start to end, in one go whatever its length
+    # returns [fraction of the segment, entity or True for a wall], or None if nothing is hit
+    blocks = []
+    fraction = cast(start.x, start.z, end.x, end.z, True, blocks)
+
+    # floor and ceiling
+    for y in (0, 1):
+        if (start.y-y) * (end.y-y) < 0:
+            at = (start.y-y) / (start.y-end.y)
+            fraction = at if fraction is None else min(fraction, at)
+    hit = None if fraction is None else [fraction, True]
+
+    # entities: only the ones around the crossed blocks
+    ignore = {id(entity) for entity in ignore}
+    near = set()
+    for x, z in blocks:
+        near.update(grid.near(x, z))
+    for entity in near:
+        if id(entity) not in ignore:
+            at = entity.hitbox.entry(start.x, start.z, end.x-start.x, end.z-start.z)
+            if at is not None and (hit is None or at < hit[0]):
+                hit = [at, entity]
+
+    return hit
+
+def visible(a, b):
+    # cached line of sight between the centers of two blocks
+    key = (a, b) if a < b else (b, a)
+    if key not in sight:
+        sight[key] = line_of_sight(a[0]+0.5, a[1]+0.5, b[0]+0.5, b[1]+0.5)
+    return sight[key]
 
 class FloatRect:
     # pygame Rect doesn't support float coordinates
@@ -35,20 +199,253 @@ class FloatRect:
         return self.right > rect.left and self.left < rect.right and \
                self.top < rect.bottom and self.bottom > rect.top
 
+    def entry(self, x, y, dx, dy):
+        # fraction of the segment from (x, y) to (x+dx, y+dy) where it enters the rect, None if it misses it
+        start, end = 0, 1
+        for pos, delta, low, high in [(x, dx, self.left, self.right), (y, dy, self.top, self.bottom)]:
+            if delta:
+                a, b = sorted([(low-pos) / delta, (high-pos) / delta])
+                start, end = max(start, a), min(end, b)
+            elif not low <= pos <= high:
+                return None
+        if start > end:
+            return None
+        return start
+
+class Grid:
+    # spatial hash of the entities, keyed on the block they are in
+    # entities are smaller than a block: they can only touch the ones in the 3x3 blocks around
+
+    def __init__(self, entities):
+        self.cells = {}
+        for entity in entities:
+            entity.cell = None
+            self.move(entity)
+
+    def move(self, entity):
+        cell = (floor(entity.pos.x), floor(entity.pos.z))
+        if cell != entity.cell:
+            self.remove(entity)
+            self.cells.setdefault(cell, set()).add(entity)
+            entity.cell = cell
+
+    def remove(self, entity):
+        if entity.cell is not None:
+            cell = self.cells[entity.cell]
+            cell.discard(entity)
+            if not cell:
+                del self.cells[entity.cell]
+            entity.cell = None
+
+    def near(self, x, z):
+        X, Z = floor(x), floor(z)
+        for dx in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                yield from self.cells.get((X+dx, Z+dz), ())
+
+class FlowField:
+    # distance (in blocks) from every block near the player to the player, shared by all monsters
+    # only computed again when the player changes block
+
+    def __init__(self, radius=16):
+        self.radius = radius # how far to follow the player
+        self.root = None
+        self.dist = {}
+
+    def update(self, pos):
+        root = (floor(pos.x), floor(pos.z))
+        if root == self.root:
+            return
+        self.root = root
+
+        # breadth-first search through the air blocks
+        m, n = len(maze[0]), len(maze)
+        x, z = root
+        self.dist = {root: 0} if 0 <= x < m and 0 <= z < n and maze[z][x] <= 0 else {}
+        todo = list(self.dist)
+        for d in range(1, self.radius+1):
+            next_ = []
+            for x, z in todo:
+                for block in [(x, z-1), (x+1, z), (x, z+1), (x-1, z)]:
+                    x_, z_ = block
+                    if block not in self.dist and 0 <= x_ < m and 0 <= z_ < n and maze[z_][x_] <= 0:
+                        self.dist[block] = d
+                        next_.append(block)
+            todo = next_
+
+    def step(self, pos):
+        # center of the next block on the way to the player, None if too far
+        x, z = floor(pos.x), floor(pos.z)
+        d = self.dist.get((x, z))
+        if not d:
+            return None
+        for x_, z_ in [(x, z-1), (x+1, z), (x, z+1), (x-1, z)]:
+            if self.dist.get((x_, z_)) == d-1:
+                return Vector3(x_+0.5, 0, z_+0.5)
+
+class Scheduler:
+    # monsters near the player are updated every frame, the ones around at a lower rate
+    # and the far ones sleep until their next move, or until the player comes near
+
+    near, mid = 8, 16 # tiers radius, in blocks around the player
+    mid_delay, far_delay = 100, 250 # time between the updates (ms)
+    max_step = 0.25 # longest time simulated at once when chasing (s)
+
+    def __init__(self, entities):
+        self.active = set() # near monsters
+        self.found = None # [player block, when]: last search of the near monsters
+        self.queue = [] # [wake time, order, monster]
+        self.order = count() # also tells which entry of a monster is the current one
+
+        now = ticks()
+        for entity in entities:
+            if entity != player:
+                entity.updated = now
+                self.schedule(entity, now + randint(0, self.far_delay)) # spread the updates
+
+    def schedule(self, monster, wake):
+        monster.wake = next(self.order)
+        heappush(self.queue, (wake, monster.wake, monster))
+
+    def run(self, monster, time_passed):
+        with profiler.span(monster.name): # cost of every monster type
+            monster.save()
+            monster.update(time_passed)
+            if brain is not None:
+                brain.give(monster)
+
+    def update(self, time_passed):
+        now = ticks()
+        if brain is not None: # the decisions of the last step
+            with profiler.span('brain'):
+                brain.wait()
+
+        # near monsters: found with the grid, whatever the number of monsters in the level
+        # searched again when the player changes block, or when the monsters could have moved
+        X, Z = floor(player.pos.x), floor(player.pos.z)
+        if self.found is None or self.found[0] != (X, Z) or now-self.found[1] >= self.mid_delay:
+            self.found = [(X, Z), now]
+            active = set()
+            for x in range(X-self.near, X+self.near+1):
+                for z in range(Z-self.near, Z+self.near+1):
+                    active.update(grid.cells.get((x, z), ()))
+            active.discard(player)
+
+            for monster in self.active - active: # went away from the player
+                if monster.cell is not None:
+                    self.schedule(monster, now)
+            self.active = active
+        active = self.active
+
+        for monster in active:
+            if monster.cell is not None: # not dead
+                self.run(monster, time_passed)
+                monster.updated = now
+
+        # other monsters: catch up with the time spent asleep
+        while self.queue and self.queue[0][0] <= now:
+            _, order, monster = heappop(self.queue)
+            if order != monster.wake or monster in active or monster.cell is None:
+                continue # rescheduled, updated every frame or dead
+
+            time_passed = (now-monster.updated) / 1000
+            # wandering never goes past its goal: no need to split the time
+            steps = 1 if monster.last_see is None else max(ceil(time_passed/self.max_step), 1)
+            for _ in range(steps):
+                self.run(monster, time_passed/steps)
+            monster.updated = now
+
+            if monster.cell is not None:
+                self.schedule(monster, self.wake(monster, now))
+
+        if brain is not None: # decide for the next step while the rest of the frame is done
+            brain.start(player, now)
+
+    def wake(self, monster, now):
+        # when a monster that is not near the player needs to be updated again
+        X, Z = monster.cell
+        if max(abs(X-floor(player.pos.x)), abs(Z-floor(player.pos.z))) <= self.mid or monster.type_:
+            return now+self.mid_delay # around the player, or animated
+        if monster.last_see is None and monster.walk_goal is not None:
+            pos, when = monster.walk_goal
+            if when > now: # waiting before walking again
+                return when
+            return now + max(self.far_delay, monster.pos.distance_to(pos)/monster.speed*1000) # walking
+        return now+self.far_delay
+
+class Doors:
+    # start and exit doors of a level, and their animations
+    def __init__(self, maze):
+        self.doors = [[Vector3(1, 0, 1), -1], [Vector3(len(maze[0])-1, 0, len(maze)-2), -1]] # [pos, normal x]
+        self.trigger = None # [index, when]: 0 = entrance opening, 1 = exit opening, 2 = exit closing
+
+    def start(self, index):
+        self.trigger = [index, ticks()]
+        door.play()
+
+    def update(self):
+        # returns True once the exit door is closed behind the player
+        if not self.trigger:
+            return False
+
+        index, when = self.trigger
+        progress = (ticks()-when)/400
+        doors = self.doors
+
+        if progress > 1: # the door is fully opened
+            if index == 0: # entrance door opened
+                self.trigger = None
+                doors[0][0].y = 1
+                set_block(1, 1, 0) # allow to go in the maze
+
+            elif index == 1: # exit door opened
+                doors[1][0].y = 1
+                if player.pos.x - player.size[0]/2 > len(maze[0])-1: # if player is in the lift
+                    # close the exit door
+                    self.start(2)
+
+                    doors[1][1] = 1 # the door will face the player
+                    set_block(-2, -2, 1) # prevent the player from going back in the maze
+
+            elif index == 2: # exit door closed
+                return True
+
+        else: # door animation
+            if index == 0: # start door opening
+                doors[0][0].y = progress
+            elif index == 1: # exit door opening
+                doors[1][0].y = progress
+            elif index == 2: # exit door closing
+                doors[1][0].y = 1-progress
+
+        return False
+
 class Entity:
     def __init__(self):
         self.movement = Vector3()
         self.hitbox = FloatRect(0, 0, 0, 0)
+        self.cell = None # block in the grid
+        self.last = None # [step, position at the previous step]
 
         self.weapon_delay = 800
         self.last_shot = 0
         self.damage = 30 # dealt by bullets
         self.hit = 0
 
+    def save(self):
+        # before moving during a step of the simulation
+        self.last = [frame, Vector3(self.pos)]
+
+    def view(self):
+        # where to render, between the last two steps
+        if self.last is None or self.last[0] != frame:
+            return self.pos
+        return self.last[1].lerp(self.pos, blend)
+
     def get_camera(self):
         return self.pos, self.rot
 
-    def collide(self, *ignore):
+    def collide(self, *ignore, check_entities=True):
         # also set up the hitbox: center at the bottom
         w, h = self.size
         self.hitbox = FloatRect(self.pos.x - w/2, self.pos.z - w/2, w, w)
@@ -71,18 +468,8 @@ class Entity:
             out_bounds = True
             self.pos.y = min(max(self.pos.y, 0), 1-h)
 
-        # also check if hit (other) entity
-        hit_entity = None
-
         touch_ = [] # used to do the collisions in a specific order
-        for current in touch+entities:
-            if current in entities:
-                if current == self or current in ignore or type(current) in [Particle, Bullet]:
-                    continue
-                hit = current.hitbox
-            else:
-                hit = current
-
+        for hit in touch:
             if self.hitbox.colliderect(hit):
                 if self.movement.x < 0: # right side
                     dx = self.hitbox.left-hit.right
@@ -92,11 +479,15 @@ class Entity:
                     dz = self.hitbox.top-hit.bottom
                 else:
                     dz = self.hitbox.bottom-hit.top
+                touch_.append((dx, dz))
 
-                if current in entities: # entity has been hit
+        # also check if hit (other) entity: only the ones in the blocks around
+        hit_entity = None
+        if check_entities:
+            ignore = {id(entity) for entity in ignore}
+            for current in grid.near(self.pos.x, self.pos.z):
+                if current is not self and id(current) not in ignore and self.hitbox.colliderect(current.hitbox):
                     hit_entity = current
-                else: # wall: collide
-                    touch_.append((dx, dz))
 
         for dx, dz in sorted(touch_, key=lambda block: max(map(abs, block)), reverse=True):
             if abs(dx) > abs(dz):
@@ -106,6 +497,9 @@ class Entity:
                 self.pos.x -= dx
                 self.movement.x = 0
 
+        if self.cell is not None: # keep the grid up to date
+            grid.move(self)
+
         # return code: 0 = none, 1 = wall, obj = entity
         return (hit_entity is not None and hit_entity) or bool(len(touch_)) or out_bounds
 
@@ -126,6 +520,8 @@ class Player(Entity):
         # camera following self.pos + alterations done to it
         self.cam = Vector3(self.pos)
         self.cam_rot = Vector3(self.rot)
+        self.eye = [self.cam, self.cam_rot] # camera at the last step
+        self.last_eye = None # and at the previous one
         self.pos_offset = Vector3()
         self.rot_offset = Vector3()
 
@@ -137,12 +533,23 @@ class Player(Entity):
         self.dying = 0 # time of death start
         self.died = False
 
-        self.sounds = {name: pygame.mixer.Sound('files/sfx/%s.wav' %name) for name in ['hit', 'death']}
-        self.sounds['shot'] = pygame.mixer.Sound('files/sfx/shotgun.wav')
-        self.channels = [pygame.mixer.Channel(x) for x in (0, 1)] # weapon, body
+        self.sounds = {name: sound('files/sfx/%s.wav' %name) for name in ['hit', 'death']}
+        self.sounds['shot'] = sound('files/sfx/shotgun.wav')
+        self.channels = [channel(x) for x in (0, 1)] # weapon, body
         for c in self.channels:
             c.set_volume(0.7)
 
+    def look(self):
+        # camera of the current step
+        self.eye = [(self.pos+self.pos_offset)+Vector3(0, self.size[1], 0), self.rot+self.rot_offset]
+        self.cam, self.cam_rot = Vector3(self.eye[0]), Vector3(self.eye[1])
+
+    def teleport(self, pos):
+        # the camera starts from pos, instead of being interpolated from where the player was
+        self.pos = pos
+        self.last_eye = None
+        self.look()
+
     def move(self, events, time_passed):
         # rotation
         for event in events:
@@ -167,7 +574,7 @@ class Player(Entity):
 
         # movement
         movement = Vector3() # this frame
-        pressed = pygame.key.get_pressed()
+        pressed = keys()
         if pressed[K_LCTRL]: # sprint
             self.sprint = True
 
@@ -191,18 +598,16 @@ class Player(Entity):
         return movement
 
     def update(self, events, time_passed, check_collide=True):
-        global hud_surf
-
         if self.dying:
             progress = (ticks()-self.dying)/2000
 
             if progress >= 1:
                 # killed: end of animation
-                self.pos = Vector3(0.5, 0, 1.5)
                 self.hp = self.max_hp
                 self.size[1] = self.base_height
                 self.rot_offset = Vector3()
                 self.dying = 0
+                self.teleport(Vector3(0.5, 0, 1.5))
                 return
 
             # make the progress more interesting
@@ -227,8 +632,9 @@ class Player(Entity):
         # regen
         self.hp = min(self.hp + time_passed * (0.1 + (ticks()-self.last_hit) / 7000), self.max_hp)
 
-        self.cam = (self.pos+self.pos_offset)+Vector3(0, self.size[1], 0)
-        self.cam_rot = self.rot+self.rot_offset
+        flow.update(self.pos)
+        self.last_eye = self.eye
+        self.look()
 
         # damage
         if self.hit and not self.dying:
@@ -243,21 +649,18 @@ class Player(Entity):
             else:
                 self.channels[1].play(self.sounds['hit'])
 
-class Monster(Entity):
-    def __init__(self, pos, name, hp):
-        super().__init__()
+NOTICE, SHOOT = 1, 2 # actions decided by think
+
+class Mind:
+    # decisions of a monster: where to go and to look, when to notice the player and to start shooting
+    # also made on copies of the monsters in another process, see brains.py
+    def __init__(self, pos):
         self.pos = pos
         self.rot = Vector3(0, 0, 0)
-
-        self.textures = textures[name]
-        self.size = (0.4, 0.6)
-
-        self.hp = hp
-        self.speed = 1.5
-
-        self.sounds = {name: pygame.mixer.Sound('files/sfx/monsters/%s.wav' %name) for name in ['notice', 'death']}
-        self.sounds['shot'] = pygame.mixer.Sound('files/sfx/pistol.wav')
-        self.channels = [pygame.mixer.Channel(x) for x in (2, 3)] # all monsters share the same
+        self.movement = Vector3()
+        self.type_ = 0
+        self.last_shot = 0
+        self.weapon_delay = 800
 
         self.reaction = 700
         self.track_dist = 4
@@ -265,77 +668,20 @@ class Monster(Entity):
         self.last_see = None # where (vector)
         self.walk_goal = None # where to wander around: either None or [pos, when]
 
-        self.texupdate = 0 # when to update the texture
-        self.walk = 0 # walk animation index
-        self.type_ = 0 # 0 = walking, 1->3 = shooting, 4 = damage, 5+ = death
-
     def accessible(self, pos):
-        # break down the movement into steps and see if they fall in a block
-        m, n = len(maze[0]), len(maze)
-        start = Vector2(self.pos.x, self.pos.z)
-        move = Vector2(pos.x, pos.z)-start
-
-        if move.length() > self.track_dist:
+        # in range and in sight: checked between the blocks of both positions
+        if Vector2(pos.x-self.pos.x, pos.z-self.pos.z).length() > self.track_dist:
             return False
-
-        for i in range(10):
-            pos = start + move*i/10
-            x, y = floor(pos.x), floor(pos.y)
-            if 0 <= x < m and 0 <= y < n and maze[y][x] > 0:
-                return False
-        return True
+        return visible((floor(self.pos.x), floor(self.pos.z)), (floor(pos.x), floor(pos.z)))
 
     def aim_at(self, pos):
         start = Vector2(self.pos.x, self.pos.z)
         goal = Vector2(pos.x, pos.z)
         self.rot.y = -pi/2 - radians(Vector2().angle_to(goal-start))
 
-    def update(self, time_passed):
-        if self.hit:
-            self.hp -= self.hit
-            self.hit = 0
-            self.type_ = 4
-            self.texupdate = ticks()+250
-
-            if self.last_see is None: # track player if shot in the back
-                self.last_see = Vector3(player.pos)
-
-            if self.hp <= 0: # killed
-                self.type_ = 5
-                self.texupdate = ticks()+50
-
-        if ticks() >= self.texupdate: # update current texture
-            if self.type_ == 1: # shoot
-                self.type_ = 2
-                self.texupdate = ticks()+100
-
-                particles.append(Bullet(self, self.size[1]*0.65))
-                self.channels[0].play(self.sounds['shot'])
-                self.last_shot = ticks()
-
-            elif self.type_ == 2: # after shooting
-                self.type_ = 3
-                self.texupdate = ticks()+100
-
-            elif self.type_ >= 5: # dying
-                if self.type_ == 5:
-                    self.channels[1].stop()
-                    self.channels[1].play(self.sounds['death'])
-                if self.type_ == 13:
-                    entities.remove(self)
-                else:
-                    self.type_ += 1
-                self.texupdate = ticks()+50
-                return # don't do anything when dying
-
-            else: # walk
-                if self.movement.length():
-                    self.walk = (self.walk+1) % 4 # walk animation
-                else:
-                    self.walk = 1 # still
-                self.type_ = 0
-                self.texupdate = ticks()+250
-
+    def think(self):
+        # set the movement direction and the rotation, returns the actions to do (NOTICE, SHOOT)
+        actions = 0
         self.movement = Vector3()
 
         if self.accessible(player.pos) and not player.dying: # if can see/track the player
@@ -346,7 +692,7 @@ class Monster(Entity):
 
                 if in_fov: # just got aggroed
                     self.last_see = Vector3() # dummy position, needs to not be None
-                    self.channels[1].play(self.sounds['notice'])
+                    actions |= NOTICE
 
             else: # don't need to check for FOV range once aggroed
                 in_fov = True
@@ -360,8 +706,7 @@ class Monster(Entity):
                     self.movement = (player.pos-self.pos).normalize()
                 elif ticks()-self.last_shot >= self.weapon_delay:
                     # start to shoot if near or too far
-                    self.type_ = 1
-                    self.texupdate = ticks()+250
+                    actions |= SHOOT
 
                 self.last_see = Vector3(player.pos)
                 self.walk_goal = None
@@ -394,17 +739,109 @@ class Monster(Entity):
                         self.movement.y = 0
                         self.aim_at(self.walk_goal[0])
 
-            else: # try to go to the last known position
-                if self.pos.distance_to(self.last_see) < 0.2:
+            else: # chase the player through the maze, or go to the last known position
+                step = flow.step(self.pos)
+                if step is not None:
+                    self.movement = (step-self.pos)
+                    self.movement.y = 0
+                    self.movement.normalize_ip()
+                    self.aim_at(step)
+                elif self.pos.distance_to(self.last_see) < 0.2:
                     self.last_see = None
                 else:
                     self.movement = (self.last_see-self.pos).normalize()
                     self.movement.y = 0
 
+        return actions
+
+class Monster(Entity, Mind):
+    def __init__(self, pos, name, hp):
+        Entity.__init__(self)
+        Mind.__init__(self, pos)
+
+        self.name = name
+        self.textures = textures[name]
+        self.size = (0.4, 0.6)
+
+        self.hp = hp
+        self.speed = 1.5
+
+        self.sounds = {name: sound('files/sfx/monsters/%s.wav' %name) for name in ['notice', 'death']}
+        self.sounds['shot'] = sound('files/sfx/pistol.wav')
+        self.channels = [channel(x) for x in (2, 3)] # all monsters share the same
+
+        self.texupdate = 0 # when to update the texture
+        self.walk = 0 # walk animation index
+
+    def update(self, time_passed):
+        if brain is not None: # decided during the last step, in the other process: before a hit changes what it knows
+            actions = brain.take(self)
+
+        if self.hit:
+            self.hp -= self.hit
+            self.hit = 0
+            self.type_ = 4
+            self.texupdate = ticks()+250
+
+            if self.last_see is None: # track player if shot in the back
+                self.last_see = Vector3(player.pos)
+
+            if self.hp <= 0: # killed
+                self.type_ = 5
+                self.texupdate = ticks()+50
+
+        if ticks() >= self.texupdate: # update current texture
+            if self.type_ == 1: # shoot
+                self.type_ = 2
+                self.texupdate = ticks()+100
+
+                particles.append(Bullet(self, self.size[1]*0.65))
+                self.channels[0].play(self.sounds['shot'])
+                self.last_shot = ticks()
+
+            elif self.type_ == 2: # after shooting
+                self.type_ = 3
+                self.texupdate = ticks()+100
+
+            elif self.type_ >= 5: # dying
+                if self.type_ == 5:
+                    self.channels[1].stop()
+                    self.channels[1].play(self.sounds['death'])
+                if self.type_ == 13:
+                    entities.remove(self)
+                    grid.remove(self)
+                else:
+                    self.type_ += 1
+                self.texupdate = ticks()+50
+                return # don't do anything when dying
+
+            else: # walk
+                if self.movement.length():
+                    self.walk = (self.walk+1) % 4 # walk animation
+                else:
+                    self.walk = 1 # still
+                self.type_ = 0
+                self.texupdate = ticks()+250
+
+        if brain is None:
+            actions = self.think()
+
+        if actions & NOTICE:
+            self.channels[1].play(self.sounds['notice'])
+        if actions & SHOOT and self.type_ == 0:
+            self.type_ = 1
+            self.texupdate = ticks()+250
+
+        if self.last_see is None and self.walk_goal is not None and self.movement.length():
+            # don't walk past the goal when updated rarely
+            distance = self.pos.distance_to(self.walk_goal[0])
+            if time_passed*self.speed > distance:
+                self.movement *= distance / (time_passed*self.speed)
+
         self.pos += self.movement*time_passed*self.speed
         collide = self.collide()
-        if type(collide) != bool and collide != player: # entity is blocking it
-            self.last_see = None # stop chasing
+        if type(collide) != bool and collide != player and flow.step(self.pos) is None:
+            self.last_see = None # entity is blocking it and the player is too far: stop chasing
 
     def render(self):
         # get the "side" of the entity that is seen by the camera
@@ -414,64 +851,31 @@ class Monster(Entity):
 
         # get the angle at which the texture must be drawn to face the camera
         v = Vector3(cos(player.rot.y), 0, -sin(player.rot.y))
-        top = Vector3(0, self.size[1], 0)
+        pos = self.view()
 
         if self.type_ == 0:
-            texture, size = self.textures['walk%d%d' %(self.walk, angle)]
+            sheet, rect, size = self.textures['walk%d%d' %(self.walk, angle)]
         elif self.type_ >= 5:
-            texture, size = self.textures['die%d' %(self.type_-5)]
+            sheet, rect, size = self.textures['die%d' %(self.type_-5)]
         else:
-            texture, size = self.textures[['aim%d', 'shoot%d', 'aim%d', 'dmg%d'][self.type_-1] %(angle)]
-
-        glBindTexture(GL_TEXTURE_2D, texture)
-        glBegin(GL_QUADS)
-        glNormal3f(-v.z, 0, v.x) # normal rotated 90°
-        v *= self.size[1]*size[0]/size[1]/2
-        glTexCoord2f(0, 0)
-        glVertex(self.pos-v)
-        glTexCoord2f(1, 0)
-        glVertex(self.pos+v)
-        glTexCoord2f(1, 1)
-        glVertex(self.pos+v+top)
-        glTexCoord2f(0, 1)
-        glVertex(self.pos-v+top)
-        glEnd()
+            sheet, rect, size = self.textures[['aim%d', 'shoot%d', 'aim%d', 'dmg%d'][self.type_-1] %(angle)]
+
+        # drawn later with the other sprites
+        normal = (-v.z, 0, v.x) # rotated 90°
+        billboards.add(sheet, rect, pos, v*(self.size[1]*size[0]/size[1]/2), self.size[1], normal)
 
 class Particle(Entity):
-    def __init__(self, *args):
+    def __init__(self):
         super().__init__()
         self.timer = None # once non-None, will despawn after some time
         self.ttl = 1000
 
-        # normal particle: specifies position (calling from other classes will have no arguments passed
-        if len(args):
-            self.size = (0.01, 0.02)
-            self.color = args[1]
-            speed = args[2]
-
-            self.pos = Vector3(args[0])
-            self.movement = Vector3(randint(-100, 100)/50*speed,
-                                    randint(0, 100*speed)/100,
-                                    randint(-100, 100)/50*speed)
-            self.dy = randint(10, 30) # fall at random speed
-
-    def update(self, time_passed):
-        self.movement *= 0.9**(100*time_passed)
-        self.movement.y -= self.dy*time_passed
-        self.pos += self.movement*time_passed
-
-        if self.collide(*entities) == 1 and self.timer is None:
-            self.timer = ticks()+self.ttl
-
-        if self.timer is not None and ticks() >= self.timer:
-            particles.remove(self)
-
     def render(self):
         size = self.size[0]
 
         normals = [(0, 0, -1), (1, 0, 0), (0, 0, 1), (-1, 0, 0)]
         offset = [[(-1, -1), (1, -1)], [(1, -1), (1, 1)], [(1, 1), (-1, 1)], [(-1, 1), (-1, -1)]]
-        x, y, z = self.pos
+        x, y, z = self.view()
 
         glBindTexture(GL_TEXTURE_2D, textures['white'])
         glColor3dv(self.color)
@@ -513,13 +917,19 @@ class Bullet(Particle):
         self.movement = Vector3(-sin(y)*cos(x), sin(x), -cos(y)*cos(x))
 
     def update(self, time_passed):
-        self.pos += self.movement*time_passed*self.speed
-        collide = self.collide(self.master)
-        if collide and self.timer is None:
+        if self.timer is None: # flying: find what is hit on the whole way of this step
+            end = self.pos + self.movement*time_passed*self.speed
+            hit = raycast(self.pos, end, self, self.master)
+            if hit is None:
+                self.pos = end
+                return
+
+            fraction, collide = hit
+            self.pos = self.pos.lerp(end, fraction) - self.movement*0.001 # stay in front of the wall
             self.movement = Vector3()
             self.timer = ticks()+self.ttl
 
-            if type(collide) != bool:
+            if collide is not True:
                 collide.hit = self.power
                 color = (1, 0, 0)
 
@@ -529,9 +939,117 @@ class Bullet(Particle):
                 color = (0.3, 0.3, 0.3)
                 bullet.play()
 
-            for x in range(10):
-                particles.append(Particle(self.pos, color, 1))
+            debris.emit(self.pos, color, 1, impact)
 
         if self.timer is not None and ticks() >= self.timer:
             # despawn
             particles.remove(self)
+
+def cube(size):
+    # vertices of a cube around the origin: color (4), normal and position for each one
+    vertices = []
+    for normal, (a, b) in zip([(0, 0, -1), (1, 0, 0), (0, 0, 1), (-1, 0, 0)],
+                              [[(-1, -1), (1, -1)], [(1, -1), (1, 1)], [(1, 1), (-1, 1)], [(-1, 1), (-1, -1)]]):
+        for (x, z), y in [(a, -1), (b, -1), (b, 1), (a, 1)]: # sides
+            vertices.append([1, 1, 1, 1, *normal, x*size, y*size, z*size])
+    for face in [-1, 1]: # top and bottom
+        for x, z in [(-1, -1), (1, -1), (1, 1), (-1, 1)]:
+            vertices.append([1, 1, 1, 1, 0, face, 0, x*size, -face*size, z*size])
+    return np.array(vertices, np.float32)
+
+class Particles:
+    # pool of debris particles: every particle is a line in preallocated arrays
+    # they are all moved, collided and drawn at once
+    size = (0.01, 0.02)
+
+    def __init__(self, capacity=4096):
+        self.cube = cube(self.size[0])
+        self.count = 0 # particles alive, at the start of the arrays
+        self.pos = np.zeros((capacity, 3), np.float32)
+        self.last = np.zeros((capacity, 3), np.float32) # position at the previous step
+        self.movement = np.zeros((capacity, 3), np.float32)
+        self.dy = np.zeros(capacity, np.float32) # fall speed
+        self.color = np.zeros((capacity, 3), np.float32)
+        self.timer = np.zeros(capacity) # when to despawn, inf until touching something
+
+    def emit(self, pos, color, speed, count):
+        # make room by removing the oldest particles if needed
+        full = self.count+count - len(self.pos)
+        if full > 0:
+            self.keep(np.arange(self.count) >= full)
+
+        new = slice(self.count, self.count+count)
+        self.pos[new] = self.last[new] = pos
+        self.movement[new, 0] = np.random.randint(-100, 101, count)/50*speed
+        self.movement[new, 1] = np.random.randint(0, 100*speed+1, count)/100
+        self.movement[new, 2] = np.random.randint(-100, 101, count)/50*speed
+        self.dy[new] = np.random.randint(10, 31, count) # fall at random speed
+        self.color[new] = color
+        self.timer[new] = np.inf
+        self.count += count
+
+    def keep(self, alive):
+        # only keep the particles where alive is True
+        count = int(alive.sum())
+        for array in [self.pos, self.last, self.movement, self.dy, self.color, self.timer]:
+            array[:count] = array[:self.count][alive]
+        self.count = count
+
+    def update(self, time_passed):
+        if not self.count:
+            return
+        pos, movement = self.pos[:self.count], self.movement[:self.count]
+
+        movement *= 0.9**(100*time_passed)
+        movement[:, 1] -= self.dy[:self.count]*time_passed
+        old = self.last[:self.count]
+        old[:] = pos
+        pos += movement*time_passed
+
+        # stay in the maze
+        w, h = self.size
+        m, n = len(maze[0]), len(maze)
+        touch = (pos[:, 0] < w/2) | (pos[:, 0] > m - w/2) | (pos[:, 1] < 0) | (pos[:, 1] > 1-h)
+        pos[:, 0] = np.clip(pos[:, 0], w/2, m - w/2)
+        pos[:, 1] = np.clip(pos[:, 1], 0, 1-h)
+
+        # walls: go back on the axes that lead inside a block
+        def solid(x, z):
+            x, z = np.floor(x).astype(int), np.floor(z).astype(int)
+            inside = (0 <= x) & (x < m) & (0 <= z) & (z < n)
+            return inside & (maze[np.clip(z, 0, n-1), np.clip(x, 0, m-1)] > 0)
+
+        wall = solid(pos[:, 0], pos[:, 2])
+        if wall.any():
+            back_x = wall & solid(pos[:, 0], old[:, 2])
+            back_z = wall & solid(old[:, 0], pos[:, 2])
+            back_x |= wall & ~back_x & ~back_z # corner
+            back_z |= wall & ~back_x & ~back_z
+            pos[back_x, 0] = old[back_x, 0]
+            pos[back_z, 2] = old[back_z, 2]
+            movement[back_x, 0] = 0
+            movement[back_z, 2] = 0
+            touch |= wall
+
+        # start the despawn timer when touching something
+        timer = self.timer[:self.count]
+        timer[touch & np.isinf(timer)] = ticks()+1000
+
+        self.keep(timer > ticks())
+
+    def render(self):
+        if not self.count:
+            return
+
+        # all the cubes in a single vertex array
+        vertices = np.repeat(self.cube[None], self.count, 0)
+        vertices[:, :, :3] = self.color[:self.count, None]
+        last = self.last[:self.count]
+        vertices[:, :, 7:] += (last + (self.pos[:self.count]-last)*blend)[:, None]
+
+        glBindTexture(GL_TEXTURE_2D, textures['white'])
+        glInterleavedArrays(GL_C4F_N3F_V3F, 0, vertices)
+        glDrawArrays(GL_QUADS, 0, self.count*len(self.cube))
+        for array in [GL_VERTEX_ARRAY, GL_NORMAL_ARRAY, GL_COLOR_ARRAY]:
+            glDisableClientState(array)
+        glColor3f(1, 1, 1)
@@ -0,0 +1,102 @@
+import os
+# no window and no sound card needed
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+import numpy as np
+
+from time import perf_counter
+from random import randrange
+from pygame.math import Vector3
+from pygame.locals import *
+
+import entities
+from entities import *
+from maze import *
+from level import *
+from profiler import profiler
+
+# runs the game simulation without rendering nor audio, at a fixed timestep and with scripted input
+# usage: see bench.py
+
+walls_names = ['bricks', 'slimybricks', 'ironplates', 'concrete']
+options = {'fov': 70, 'move_keys': 'wasd'}
+
+class Clock:
+    # simulated time (ms), advanced by hand instead of following the real time
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+class Keys:
+    # stands in for pygame.key.get_pressed: the set of the held keys
+    def __init__(self):
+        self.held = set()
+
+    def __call__(self):
+        return self
+
+    def __getitem__(self, key):
+        return key in self.held
+
+def wander(game):
+    # default script: walk forwards, turn from time to time and shoot every second
+    game.keys.held = {ord('w')}
+    events = []
+    if randrange(30) == 0:
+        events.append(pygame.event.Event(MOUSEMOTION, rel=(randrange(-200, 200), 0)))
+    if game.clock.now % 1000 < game.dt*1000:
+        events.append(pygame.event.Event(MOUSEBUTTONDOWN, button=1))
+    return events
+
+class Game:
+    def __init__(self, m, n, monsters=None, dt=1/60, seed=None):
+        # level of m x n cells, with its own random monsters or the given number of them
+        # the same seed always gives the same level and monsters
+        pygame.init()
+        entities.audio = False
+        self.clock, self.keys, self.dt = Clock(), Keys(), dt
+        entities.keys = self.keys
+
+        send_tex({'SoldierGun': {}, 'SoldierShotgun': {}})
+        self.particles = [] # bullets
+        self.debris = Particles()
+        self.player = Player()
+        send_vars(900, 500, self.clock, self.player, self.particles, self.debris, Silent(), Silent(), options)
+
+        maze = gen_level(m, n, len(walls_names), seed).maze
+        spawns = [(Vector3(x+0.5, 0, z+0.5), maze[z][x]) for z, x in np.argwhere(maze < 0)]
+        if monsters is not None: # spread the monsters in the air blocks
+            rng = np.random.default_rng(seed)
+            air = np.argwhere(maze <= 0)
+            air = air[rng.permutation(len(air))[:monsters]]
+            spawns = [(Vector3(x+0.5, 0, z+0.5), -1 - (rng.random() < 1/3)) for z, x in air]
+        maze[1][1] = maze[-2][-1] = 1
+
+        self.entities = [self.player]
+        for spawn, value in spawns:
+            if value == -1:
+                self.entities.append(Monster(spawn, 'SoldierGun', 50))
+            if value == -2:
+                self.entities.append(Monster(spawn, 'SoldierShotgun', 100))
+
+        self.maze = maze
+        self.doors = Doors(maze)
+        send_lists(maze, self.entities, self.doors)
+        self.doors.start(0) # like at the end of the lift ride
+
+    def run(self, count, script=wander):
+        # simulate count ticks, returns the time taken (s)
+        start = perf_counter()
+        for _ in range(count):
+            self.clock.now += self.dt*1000
+            events = script(self)
+            for event in pygame.event.get(USEREVENT): # exit door opened
+                self.doors.start(1)
+                set_block(-1, -2, 0)
+            if tick(events, self.dt):
+                break
+        return perf_counter()-start
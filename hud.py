@@ -0,0 +1,80 @@
+import ctypes
+import numpy as np
+
+from OpenGL.GL import *
+
+# 2d elements, drawn in this order on top of the 3d view
+SLOTS = ['crosshair', 'hp_back', 'hp', 'fade', 'overlay', 'profiler'] + ['text%d' %x for x in range(8)]
+
+class Hud:
+    # retained 2d layer: every element is a quad of one vertex buffer, textured from one atlas
+    # the elements keep their quad between frames and only the changed ones are sent again
+    def __init__(self, texture, rects, size, slots=SLOTS):
+        # texture, rects: atlas of the images and their rectangles in it, as made by pack, size: of the atlas
+        self.texture, self.rects, self.size = texture, rects, size
+
+        # every vertex is interleaved as GL_T2F_C4F_N3F_V3F, hidden elements are all zeros
+        self.slots = {name: index for index, name in enumerate(slots)}
+        self.vertices = np.zeros((len(slots), 4, 12), np.float32)
+        self.dirty = set()
+        self.buffer = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.buffer)
+        glBufferData(GL_ARRAY_BUFFER, self.vertices.nbytes, self.vertices, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def image_size(self, image):
+        # size in pixels of an image of the atlas
+        u0, v0, u1, v1 = self.rects[image]
+        return round((u1-u0)*self.size[0]), round((v1-v0)*self.size[1])
+
+    def set(self, slot, image, corners, color=(1, 1, 1, 1)):
+        # show an image in a slot, corners: top left, top right, bottom right, bottom left on the screen
+        u0, v0, u1, v1 = self.rects[image]
+        quad = np.zeros((4, 12), np.float32)
+        quad[:, :2] = [(u0, v1), (u1, v1), (u1, v0), (u0, v0)]
+        quad[:, 2:6] = tuple(color) + (1,)*(4-len(color))
+        quad[:, 8] = 1
+        quad[:, 9:11] = corners
+        self.update(slot, quad)
+
+    def rect(self, slot, image, x, y, w=None, h=None, color=(1, 1, 1, 1)):
+        # show an image in a slot, at x, y (top left) and stretched to w, h if given
+        if w is None:
+            w, h = self.image_size(image)
+        self.set(slot, image, [(x, y), (x+w, y), (x+w, y+h), (x, y+h)], color)
+
+    def hide(self, slot):
+        self.update(slot, np.zeros((4, 12), np.float32))
+
+    def update(self, slot, quad):
+        index = self.slots[slot]
+        if not np.array_equal(self.vertices[index], quad):
+            self.vertices[index] = quad
+            self.dirty.add(index)
+
+    def paint(self, image, data):
+        # replace the pixels of an image of the atlas with RGBA data (from the bottom line) of the same size
+        x, y = round(self.rects[image][0]*self.size[0]), round(self.rects[image][1]*self.size[1])
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        glTexSubImage2D(GL_TEXTURE_2D, 0, x, y, *self.image_size(image), GL_RGBA, GL_UNSIGNED_BYTE, data)
+
+    def render(self):
+        # send the changed elements, then a single draw call for all of them
+        glBindBuffer(GL_ARRAY_BUFFER, self.buffer)
+        size = self.vertices[0].nbytes
+        for index in self.dirty:
+            glBufferSubData(GL_ARRAY_BUFFER, index*size, size, self.vertices[index])
+        self.dirty.clear()
+
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glInterleavedArrays(GL_T2F_C4F_N3F_V3F, 0, ctypes.c_void_p(0))
+        glDrawArrays(GL_QUADS, 0, len(self.vertices)*4)
+
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        for array in [GL_VERTEX_ARRAY, GL_COLOR_ARRAY, GL_NORMAL_ARRAY, GL_TEXTURE_COORD_ARRAY]:
+            glDisableClientState(array)
+
+    def delete(self):
+        glDeleteBuffers(1, [self.buffer])
+        glDeleteTextures(1, [self.texture])
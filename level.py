@@ -0,0 +1,126 @@
+import os
+import mmap
+import struct
+import numpy as np
+
+from math import floor, ceil
+from random import Random
+
+from maze import *
+from mesh import random_flats
+from texpack import align
+
+LEVELS = 'files/levels' # cache of the generated levels
+MIN_TILE = 24 # smallest tiles worth a worker process: about 1 ms to make, a few times what sending one costs
+MAGIC = b'MAZELVL1'
+HEADER = '<8sQHHIIB' # magic, seed, lines and columns of blocks, number of solid blocks and spawns, bits per texture
+
+# file layout: header, then every array from the start of a line of 16 bytes, all of them 1 bit per block:
+# solid blocks (line after line), textures of the solid blocks (every bit of the textures-1, one after the other),
+# spawns among the air blocks, monster of every spawn (0: SoldierGun, 1: SoldierShotgun),
+# light ceilings and mossy floors of the air blocks
+
+def level_size(number):
+    # cells of the maze of the level number
+    return 2 + floor(number/2), 2 + ceil(number/2)
+
+def level_seed(seed, number):
+    # seed of the level number of a game started with seed
+    return seed*2**20 + number
+
+def level_tile(m, n, workers):
+    # size of the tiles of gen_tiled that give every worker about one tile, 0 to use gen
+    # gen is used without workers, and for the mazes too small to make tiles of MIN_TILE cells (before level 92)
+    side = min(ceil(workers**0.5), max(n, m) // MIN_TILE) # tiles in a line
+    return ceil(max(n, m) / side) if side > 1 else 0
+
+class Level:
+    # everything random about a level: its blocks (with the textures of the walls and where the monsters spawn)
+    # and its flats (mossy floors and light ceilings of the air blocks, as used by level_quads)
+    def __init__(self, seed, maze, flats):
+        self.seed, self.maze, self.flats = seed, maze, flats
+
+def gen_level(m, n, max_wall, seed=None, tile=0, executor=None):
+    # the level of m x n cells made from seed: always the same for the same seed and tile, random without seed
+    # tile: size of the tiles of gen_tiled (see level_tile), 0 to use gen
+    # executor: process pool to generate the tiles at once, else they are generated one after the other
+    rand, rng = Random(seed), np.random.default_rng(seed)
+    if tile:
+        maze = to_blocks(gen_tiled(n, m, rand, tile, executor), max_wall, rng)
+    else:
+        maze = to_blocks(gen(n, m, rand), max_wall, rng)
+    return Level(seed, maze, random_flats(np.count_nonzero(maze <= 0), rng))
+
+def sections(n, m, solid, spawns, bits):
+    # length of every array of a level file
+    air = n*m - solid
+    return [ceil(n*m/8), bits*ceil(solid/8), ceil(air/8), ceil(spawns/8), ceil(air/8), ceil(air/8)]
+
+def save_level(level, path):
+    maze = level.maze
+    solid = maze > 0
+    walls = maze[solid]-1
+    bits = int(walls.max(initial=0)).bit_length()
+    planes = b''.join(np.packbits(walls >> bit & 1).tobytes() for bit in range(bits))
+    spawns = maze[~solid]
+    mossy, lit = level.flats
+    arrays = [np.packbits(solid), planes, np.packbits(spawns < 0), np.packbits(spawns[spawns < 0] == -2),
+              np.packbits(lit), np.packbits(mossy)]
+
+    with open(path, 'wb') as f:
+        f.write(struct.pack(HEADER, MAGIC, level.seed, *maze.shape, np.count_nonzero(solid),
+                            np.count_nonzero(spawns < 0), bits))
+        for array in arrays:
+            f.seek(align(f.tell()))
+            f.write(bytes(array))
+
+def load_level(path):
+    # read a level file mapped in memory, its bits are unpacked straight from the map
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if len(data) < struct.calcsize(HEADER):
+        raise ValueError('%s is not a level' %path)
+    magic, seed, n, m, solid, spawns, bits = struct.unpack_from(HEADER, data)
+    if magic != MAGIC:
+        raise ValueError('%s is not a level' %path)
+
+    arrays, offset = [], struct.calcsize(HEADER)
+    for size in sections(n, m, solid, spawns, bits):
+        offset = align(offset)
+        arrays.append(np.frombuffer(data, np.uint8, size, offset)) # raises ValueError if the file is too short
+        offset += size
+    blocks, planes, spawn_bits, kinds, lit, mossy = arrays
+    air = n*m - solid
+
+    maze = np.unpackbits(blocks, count=n*m).reshape(n, m).astype(np.int8)
+    walls = maze > 0
+    size = ceil(solid/8)
+    for bit in range(bits):
+        maze[walls] += np.unpackbits(planes[bit*size:(bit+1)*size], count=solid).astype(np.int8) << bit
+
+    monsters = np.unpackbits(spawn_bits, count=air).astype(bool)
+    values = np.zeros(air, np.int8)
+    values[monsters] = -1 - np.unpackbits(kinds, count=spawns).astype(np.int8)
+    maze[~walls] = values
+
+    return Level(seed, maze, (np.unpackbits(mossy, count=air).astype(bool), np.unpackbits(lit, count=air).astype(bool)))
+
+def level_path(m, n, seed, tile=0):
+    # gen and gen_tiled make different mazes from the same seed, as does every tile size
+    return '%s/%d_%dx%d%s.level' %(LEVELS, seed, m, n, '_%d' %tile if tile else '')
+
+def cached_level(m, n, max_wall, seed, tile=0, executor=None):
+    # the level made from seed, read from the cache if it was already generated, else generated and cached
+    path = level_path(m, n, seed, tile)
+    try:
+        level = load_level(path)
+        if level.maze.shape == (n*2 + 1, m*2 + 1):
+            return level
+    except (OSError, ValueError): # not cached yet
+        pass
+
+    level = gen_level(m, n, max_wall, seed, tile, executor)
+    os.makedirs(LEVELS, exist_ok=True)
+    save_level(level, path)
+    return level
@@ -0,0 +1,150 @@
+import numpy as np
+
+from math import floor, ceil
+from OpenGL.GL import *
+from OpenGL.GL.shaders import compileProgram, compileShader
+
+WIDTH = 1024 # long lists are stored in textures of several lines of this width
+
+# the fixed pipeline lighting of the level, done per pixel with every light of the cluster of the pixel
+VERTEX = '''
+#version 130
+varying vec3 world;
+varying vec3 normal;
+
+void main() {
+    world = gl_Vertex.xyz; // the level geometry is already in world coordinates
+    normal = gl_Normal;
+    gl_FrontColor = gl_Color;
+    gl_TexCoord[0] = gl_MultiTexCoord0;
+    gl_Position = ftransform();
+}
+'''
+
+FRAGMENT = '''
+#version 130
+uniform sampler2D image;
+uniform sampler2D lights; // positions
+uniform isampler2D cells; // offset and number of lights of every cluster in indices
+uniform isampler2D indices; // lights of every cluster, one after the other
+uniform float cell;
+uniform vec3 eye;
+varying vec3 world;
+varying vec3 normal;
+
+ivec2 at(int index) {
+    return ivec2(index %% %d, index / %d);
+}
+
+vec3 diffuse(vec3 pos, vec3 n, float linear, float quadratic) {
+    vec3 d = pos-world;
+    float dist = length(d);
+    return vec3(max(dot(n, d/dist), 0.0) / (1.0 + linear*dist + quadratic*dist*dist));
+}
+
+void main() {
+    vec3 n = normalize(normal);
+    vec3 light = gl_LightModel.ambient.rgb;
+
+    // camera light
+    light += diffuse(eye, n, 1.0, 0.0) * gl_LightSource[0].diffuse.rgb;
+
+    // ceiling lights of the cluster
+    ivec2 size = textureSize(cells, 0);
+    ivec2 cluster = ivec2(floor(world.xz / cell));
+    if (all(greaterThanEqual(cluster, ivec2(0))) && all(lessThan(cluster, size))) {
+        ivec2 range = texelFetch(cells, cluster, 0).xy;
+        for (int i = range.x; i < range.x+range.y; i++) {
+            vec3 pos = texelFetch(lights, at(texelFetch(indices, at(i), 0).x), 0).xyz;
+            light += diffuse(pos, n, 0.0, 3.0) * vec3(0.8, 0.8, 1.0);
+        }
+    }
+
+    vec4 color = vec4(min(light * gl_Color.rgb, 1.0), gl_Color.a) * texture2D(image, gl_TexCoord[0].st);
+
+    // exp2 fog, from the depth of the pixel
+    float fog = clamp(exp(-pow(gl_Fog.density / gl_FragCoord.w, 2.0)), 0.0, 1.0);
+    gl_FragColor = vec4(mix(gl_Fog.color.rgb, color.rgb, fog), color.a);
+}
+''' %(WIDTH, WIDTH)
+
+def light_program():
+    # raises an exception if the shaders are not supported
+    return compileProgram(compileShader(VERTEX, GL_VERTEX_SHADER), compileShader(FRAGMENT, GL_FRAGMENT_SHADER))
+
+def lines(data):
+    # pad a list of values to fill lines of WIDTH values
+    count = max(ceil(len(data)/WIDTH), 1)
+    padded = np.zeros((count*WIDTH,) + data.shape[1:], data.dtype)
+    padded[:len(data)] = data
+    return padded.reshape((count, WIDTH) + data.shape[1:])
+
+class LightGrid:
+    # lights of a level sorted in square cells of blocks: every cell knows the lights that can reach it
+    def __init__(self, positions, size, cell=4, reach=3):
+        # positions: (x, y, z) of every light, size: (m, n) blocks of the level
+        # reach: distance after which a light is too attenuated to matter
+        self.positions = np.array(positions, np.float32).reshape(-1, 3)
+        self.cell = cell
+        m, n = size
+        gx, gz = max(ceil(m/cell), 1), max(ceil(n/cell), 1)
+
+        cells = [[[] for _ in range(gx)] for _ in range(gz)]
+        for index, (x, _, z) in enumerate(self.positions):
+            for cz in range(max(floor((z-reach)/cell), 0), min(floor((z+reach)/cell), gz-1)+1):
+                for cx in range(max(floor((x-reach)/cell), 0), min(floor((x+reach)/cell), gx-1)+1):
+                    # distance to the nearest point of the cell
+                    dx = max(cx*cell - x, 0, x - (cx+1)*cell)
+                    dz = max(cz*cell - z, 0, z - (cz+1)*cell)
+                    if dx*dx + dz*dz <= reach*reach:
+                        cells[cz][cx].append(index)
+
+        counts = np.array([[len(lights) for lights in line] for line in cells], np.int32)
+        self.ranges = np.stack([np.cumsum(counts).reshape(gz, gx) - counts, counts], 2).astype(np.int32)
+        self.indices = np.array([index for line in cells for lights in line for index in lights], np.int32)
+        self.textures = None # sent to OpenGL when first needed
+
+    def nearest(self, pos, count=3):
+        # the count nearest lights to pos among the ones that can reach its cell
+        cx, cz = floor(pos.x/self.cell), floor(pos.z/self.cell)
+        if not (0 <= cz < len(self.ranges) and 0 <= cx < len(self.ranges[0])):
+            return []
+
+        start, length = self.ranges[cz, cx]
+        lights = self.positions[self.indices[start:start+length]]
+        if length > count:
+            lights = lights[np.argsort(((lights - tuple(pos))**2).sum(1))[:count]]
+        return lights.tolist()
+
+    def upload(self):
+        self.textures = glGenTextures(3)
+        data = [(lines(self.positions), GL_RGB32F, GL_RGB, GL_FLOAT),
+                (self.ranges, GL_RG32I, GL_RG_INTEGER, GL_INT),
+                (lines(self.indices), GL_R32I, GL_RED_INTEGER, GL_INT)]
+        for texture, (array, internal, format, type_) in zip(self.textures, data):
+            glBindTexture(GL_TEXTURE_2D, texture)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+            glTexImage2D(GL_TEXTURE_2D, 0, internal, array.shape[1], array.shape[0], 0, format, type_,
+                         np.ascontiguousarray(array))
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+    def bind(self, program, eye):
+        # use the program with the lights, the level texture stays on unit 0
+        if self.textures is None:
+            self.upload()
+
+        glUseProgram(program)
+        for unit, (name, texture) in enumerate(zip(['lights', 'cells', 'indices'], self.textures), 1):
+            glActiveTexture(GL_TEXTURE0+unit)
+            glBindTexture(GL_TEXTURE_2D, texture)
+            glUniform1i(glGetUniformLocation(program, name), unit)
+        glActiveTexture(GL_TEXTURE0)
+        glUniform1i(glGetUniformLocation(program, 'image'), 0)
+        glUniform1f(glGetUniformLocation(program, 'cell'), self.cell)
+        glUniform3f(glGetUniformLocation(program, 'eye'), eye.x, eye.y, eye.z)
+
+    def delete(self):
+        if self.textures is not None:
+            glDeleteTextures(self.textures)
+            self.textures = None
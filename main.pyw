@@ -5,12 +5,26 @@ import numpy as np
 from pygame.math import Vector3
 
 from math import *
+from random import randrange
+from multiprocessing import get_context
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from OpenGL.GL import *
 from OpenGL.GLU import *
 from pygame.locals import *
 
 from maze import *
+from atlas import *
+from mesh import *
+from lighting import *
+from level import *
+from pvs import *
+from texpack import *
+from hud import *
 from entities import *
+from brains import Brain
+from profiler import *
+from quality import *
+from startup import *
 
 def initOpenGl():
     glViewport(0, 0, W, H)
@@ -35,7 +49,7 @@ def initOpenGl():
     glEnable(GL_FOG)
     glFogfv(GL_FOG_COLOR, (0.15, 0.2, 0.1))
     glFogi(GL_FOG_MODE, GL_EXP2)
-    glFogf(GL_FOG_DENSITY, 0.2)
+    glFogf(GL_FOG_DENSITY, FOG)
 
     # set up 3d shader
     glEnable(GL_DEPTH_TEST)
@@ -57,6 +71,9 @@ def init3d():
     gluPerspective(FOV + 10*player.sprint, W/H, 0.01, render_distance)
     glMatrixMode(GL_MODELVIEW)
 
+    # the fog hides the far plane the same way whatever the render distance
+    glFogf(GL_FOG_DENSITY, FOG * options['render_distance']/render_distance)
+
     # depth test (draw nearest surfaces on top)
     glEnable(GL_DEPTH_TEST)
 
@@ -73,12 +90,15 @@ def init3d():
     # light from the camera
     glLight(GL_LIGHT0, GL_POSITION, (player.cam.x, player.cam.y, player.cam.z, 1))
 
-    # lights from the nearest light sources
-    places = sorted(lights, key=lambda pos: pos.distance_to(player.cam))[:3]
-    for var, pos in zip([GL_LIGHT1, GL_LIGHT2, GL_LIGHT3], places):
-        glLight(var, GL_POSITION, (pos.x, pos.y, pos.z, 1))
-        glLight(var, GL_DIFFUSE, (0.8, 0.8, 1))
-        glLight(var, GL_QUADRATIC_ATTENUATION, 3)
+    # lights from the nearest light sources, found in the cell of the camera
+    places = lights.nearest(player.cam, quality['lights'])
+    for index, var in enumerate([GL_LIGHT1, GL_LIGHT2, GL_LIGHT3]):
+        if index < len(places):
+            glLight(var, GL_POSITION, (*places[index], 1))
+            glLight(var, GL_DIFFUSE, (0.8, 0.8, 1))
+            glLight(var, GL_QUADRATIC_ATTENUATION, 3)
+        else: # not enough lights near
+            glLight(var, GL_DIFFUSE, (0, 0, 0))
 
 def init2d():
     # projection mode
@@ -96,7 +116,7 @@ def init2d():
 def load_options():
     global options
     # default values
-    options = {'move_keys': 'wasd', 'fov': 70, 'render_distance': 20, 'fullscreen': True, 'discord': 'True'}
+    options = {'move_keys': 'wasd', 'fov': 70, 'render_distance': 20, 'fullscreen': True, 'discord': 'True', 'profiler': False, 'tick_rate': 60, 'clustered_lights': False, 'seed': 0, 'level_cache': False, 'gen_workers': 1, 'ai_process': False, 'target_fps': 60}
 
     try:
         # read options file
@@ -108,8 +128,12 @@ def load_options():
         # format options
         options['fov'] = min(max(int(options['fov']), 30), 120)
         options['render_distance'] = int(options['render_distance'])
-        for option in ['fullscreen', 'discord']: # bollean values
-            options[option] = 'true' in options[option].lower()
+        options['tick_rate'] = min(max(int(options['tick_rate']), 10), 240)
+        options['seed'] = min(max(int(options['seed']), 0), 2**40-1) # 0: different levels every game
+        options['gen_workers'] = max(int(options['gen_workers']), 1)
+        options['target_fps'] = min(max(int(options['target_fps']), 0), 240) # 0: never change the quality
+        for option in ['fullscreen', 'discord', 'profiler', 'clustered_lights', 'level_cache', 'ai_process']: # bollean values
+            options[option] = 'true' in str(options[option]).lower()
     except Exception as e:
         print('Error reading options.txt:')
         print(type(e), e)
@@ -121,22 +145,28 @@ def save_options():
     with open('files/options.txt', 'w') as f:
         f.write('\n'.join(['%s = %s' %(key, value) for key, value in options.items()]))
 
-def init_tex():
-    global textures
-    # maze textures
-    names = walls_names+['floor', 'mossyfloor', 'ceil', 'lightceil']+['liftfloor', 'liftwall', 'liftceil', 'lifthidden', 'gate']
-    textures = {name: to_texture(pygame.image.load('files/flats/%s.png' %name)) for name in names}
-
-    # text
-    for name in [str(x) for x in range(10)]+['level']:
-        surf = pygame.image.load('files/text/%s.png' %name)
-        textures[name] = [to_texture(surf), surf.get_size()]
-
-    # other textures: plain colors need a white texture
-    for name in ['white', 'overlay']:
-        textures[name] = to_texture(pygame.image.load('files/textures/%s.png' %name))
+def load_image(path):
+    # [w, h, RGBA data from the bottom line]: from the texture pack if built, else from the PNG
+    if texture_pack is not None and path in texture_pack:
+        return texture_pack[path]
+    surf = pygame.image.load(path)
+    return [*surf.get_size(), pygame.image.tostring(surf, 'RGBA', True)]
 
-    # monsters textures: {[ID, size] for each texture}
+def read_flats():
+    # maze textures, decoded in the background
+    names = walls_names+['floor', 'mossyfloor', 'ceil', 'lightceil']+['liftfloor', 'liftwall', 'liftceil', 'lifthidden', 'gate']
+    return {name: load_image('files/flats/%s.png' %name) for name in names}
+
+def pack_flats(images):
+    # all the maze textures in one for the level geometry, that needs to know where they are
+    global atlas
+    data, atlas = pack(images)
+    return data
+
+def read_sprites():
+    # monsters textures, decoded and packed in the background: one sprite sheet for each monster
+    # {monster: [sheet data, rect of every texture in the sheet, size of every texture]}
+    sprites = {}
     for name, texname in monsters_names:
         group = {}
         for x in range(8): # here are all the oriented textures
@@ -149,146 +179,142 @@ def init_tex():
         for die in range(9):
             group['die%d' %die] = 'MNOPQRSTU'[die]+'0'
 
-        for tex in group:
-            surf = pygame.image.load('files/monsters/%s/%s%s.png' %(name, texname, group[tex]))
-            group[tex] = [to_texture(surf), surf.get_size()]
-        textures[name] = group
+        images = {tex: load_image('files/monsters/%s/%s%s.png' %(name, texname, group[tex])) for tex in group}
+        sprites[name] = [*pack(images), {tex: images[tex][:2] for tex in group}]
+    return sprites
+
+def init_tex(flats, data, sprites, hud_images):
+    # send the decoded textures to OpenGL
+    global textures
+    textures = {name: load_texture(pixels, w, h) for name, (w, h, pixels) in flats.items()}
+    textures['atlas'] = load_texture(data, data.shape[1], data.shape[0])
+
+    # other textures: plain colors need a white texture
+    for name in ['white', 'overlay']:
+        w, h, pixels = hud_images[0][name]
+        textures[name] = load_texture(pixels, w, h)
+
+    # monsters textures: {[sheet, rect in the sheet, size] for each texture}
+    for name, (sheet, rects, sizes) in sprites.items():
+        texture = load_texture(sheet, sheet.shape[1], sheet.shape[0])
+        textures[name] = {tex: [texture, rects[tex], sizes[tex]] for tex in rects}
 
-def to_texture(surf):
-    # makes a texture readable by OpenGl
-    texture_data = pygame.image.tostring(surf, 'RGBA', True)
+def load_texture(texture_data, w, h, min_filter=GL_NEAREST):
+    # RGBA data, starting from the bottom line
     texture_id = glGenTextures(1)
     glBindTexture(GL_TEXTURE_2D, texture_id)
 
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, min_filter)
     glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
 
-    w, h = surf.get_size()
-    gluBuild2DMipmaps(GL_TEXTURE_2D, 4, w, h, GL_RGBA, GL_UNSIGNED_BYTE, texture_data)
+    if min_filter in [GL_NEAREST, GL_LINEAR]: # the mipmaps would never be used
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, w, h, 0, GL_RGBA, GL_UNSIGNED_BYTE, texture_data)
+    else:
+        gluBuild2DMipmaps(GL_TEXTURE_2D, 4, w, h, GL_RGBA, GL_UNSIGNED_BYTE, texture_data)
 
     return texture_id
 
-def update_hud(first=False):
-    # update HUD from its surface
+def quit_game():
+    discord = startup.futures.get('discord')
+    if discord is not None and discord.done() and not discord.result():
+        options['discord'] = False # not to wait for it next time
+        save_options()
+    if profiler.enabled:
+        profiler.dump('files/profile.csv')
+    if brain is not None:
+        brain.stop()
+    pygame.quit()
+    quit()
+
+def read_hud():
+    # all the 2d images, decoded and packed in one atlas in the background, with room for the profiler overlay
+    images = {name: load_image('files/text/%s.png' %name) for name in [str(x) for x in range(10)]+['level']}
+    for name in ['crosshair', 'white', 'overlay']:
+        images[name] = load_image('files/textures/%s.png' %name)
+    data, rects = pack({**images, 'profiler': [*PROFILER_SIZE, bytes(PROFILER_SIZE[0]*PROFILER_SIZE[1]*4)]})
+    return images, data, rects
+
+def init_hud(hud_images):
+    # images, data and rects of the atlas, as made by read_hud
     global hud
-    if not first:
-        glDeleteTextures(1, [hud])
-    hud = to_texture(hud_surf)
-
-def make_maze(m, n):
-    display_list = glGenLists(1) # create a display list
-    glNewList(display_list, GL_COMPILE)
-    maze = to_blocks(gen(n, m), len(walls_names)) # generate a maze
-    lights = [] # where the ceiling lights are
-
-    # draw the maze
-    normals = [(0, 0, -1), (1, 0, 0), (0, 0, 1), (-1, 0, 0)]
-    # positions are inverted because we are seeing the outside of the cubes
-    offset = [[(1, 0), (0, 0)], [(1, 1), (1, 0)], [(0, 1), (1, 1)], [(0, 0), (0, 1)]]
-    n, m = n*2 + 1, m*2 + 1
-    for z in range(n):
-        for x in range(m):
-            todo = [] # walls to draw
-            value = maze[z][x]
-            if value > 0:
-                # blocks next to
-                next_to = [(x, z-1), (x+1, z), (x, z+1), (x-1, z)]
-                if (0, 1) in next_to or (m-1, n-2) in next_to: # next to lift: lift wall textures
-                    tex = textures['liftwall']
-                else:
-                    tex = textures[walls_names[value-1]] # "normal" wall texture
-                if not z or (maze[z-1][x] <= 0):
-                    todo.append((0, tex))
-                if x == m-1 or (maze[z][x+1] <= 0):
-                    todo.append((1, tex))
-                if z == n-1 or (maze[z+1][x] <= 0):
-                    todo.append((2, tex))
-                if not x or (maze[z][x-1] <= 0):
-                    todo.append((3, tex))
-            elif value < 0:
-                spawn = Vector3(x+0.5, 0, z+0.5)
-                if value == -1:
-                    entities.append(Monster(spawn, 'SoldierGun', 50))
-                if value == -2:
-                    entities.append(Monster(spawn, 'SoldierShotgun', 100))
-
-            for face, tex in todo:
-                a, b = offset[face]
-
-                glBindTexture(GL_TEXTURE_2D, tex)
-                glBegin(GL_QUADS)
-                glNormal3dv(normals[face])
-                glTexCoord2f(0, 0)
-                glVertex3f(x+a[0], 0, z+a[1])
-                glTexCoord2f(1, 0)
-                glVertex3f(x+b[0], 0, z+b[1])
-                glTexCoord2f(1, 1)
-                glVertex3f(x+b[0], 1, z+b[1])
-                glTexCoord2f(0, 1)
-                glVertex3f(x+a[0], 1, z+a[1])
-                glEnd()
+    _, data, rects = hud_images
+    hud = Hud(load_texture(data, data.shape[1], data.shape[0]), rects, (data.shape[1], data.shape[0]))
+
+    # elements that never change
+    w, h = hud.image_size('crosshair')
+    hud.rect('crosshair', 'crosshair', (W-w) // 2, (H-h) // 2)
+    hud.set('hp_back', 'white', [(15, 7), (525, 7), (515, 33), (5, 33)], (0.3, 0.3, 0.3))
+
+@profiler.span('make_maze')
+def make_maze(number):
+    # everything needed by a level that doesn't use OpenGL: runs in the background
+    m, n = level_size(number)
+    seed = level_seed(game_seed, number)
+    tile = level_tile(m, n, options['gen_workers']) # the same with or without the processes
+    if options['level_cache']:
+        data = cached_level(m, n, len(walls_names), seed, tile, gen_pool)
+    else:
+        data = gen_level(m, n, len(walls_names), seed, tile, gen_pool) # generate a maze
+    maze = data.maze
 
-            # floor and ceiling: only add them if visible
-            if value <= 0:
-                if (x, z) in [(0, 1), (m-1, n-2)]: # lift
-                    floor = 'liftfloor'
-                    ceil = 'liftceil'
-                    lights.append(Vector3(x+0.5, 0.7, z+0.5))
-                else:
-                    if randint(0, 4):
-                        floor = 'floor'
-                    else:
-                        floor = 'mossyfloor'
-                    if randint(0, 8) and (x, z) != (m-1, n-2):
-                        ceil = 'ceil'
-                    else:
-                        ceil = 'lightceil'
-                        lights.append(Vector3(x+0.5, 0.7, z+0.5))
-                for y, normal, name in [(0, 1, floor), (1, -1, ceil)]:
-                    glBindTexture(GL_TEXTURE_2D, textures[name])
-                    glBegin(GL_QUADS)
-                    glNormal3f(0, normal, 0)
-                    for dx, dz in [(0, 0), (1, 0), (1, 1), (0, 1)]:
-                        glTexCoord2f(dx, dz)
-                        glVertex3f(x+dx, y, z+dz)
-                    glEnd()
-
-    # lift walls leading to outside of the maze
-    for x, z0, z1 in [(0, 2, 1), (m, n-2, n-1)]:
-        glBindTexture(GL_TEXTURE_2D, textures['lifthidden'])
-        glNormal3f(z0-z1, 0, 0)
-        glBegin(GL_QUADS)
-        for y, dz in [(0, 0), (1, 0), (1, 1), (0, 1)]:
-            glTexCoord2f(dz, y)
-            glVertex(x, y, [z0, z1][dz])
-        glEnd()
-
-    # end the display list
-    glEndList()
+    # build the level geometry, split in chunks
+    quads, tex, names, lights = level_quads(maze, walls_names, data.flats)
+    chunks = split(to_atlas(quads, tex, names, atlas), maze.shape)
+    lights = LightGrid([(x+0.5, 0.7, z+0.5) for x, z in lights], maze.shape[::-1]) # where the ceiling lights are
+
+    # where to spawn monsters
+    spawns = [(Vector3(x+0.5, 0, z+0.5), maze[z][x]) for z, x in np.argwhere(maze < 0)]
+
+    # what can be seen from every block, with the doors open
+    sets = VisibleSets(maze, options['render_distance'])
+    sets.build(0, 1, 4) # around the start lift, the others are built while the level is played
 
     # prevent entities form going inside the exit elevator when closed
     maze[1][1] = maze[-2][-1] = 1
 
-    return maze, lights, display_list
+    return maze, chunks, lights, spawns, sets
 
+@profiler.span('new_level')
 def new_level():
-    global level, maze, entities, lights, maze_display, doors
+    global level, maze, entities, lights, maze_mesh, doors, next_level, visible_sets
     level += 1
 
-    if maze_display is not None: # need to delete previous maze
-        glDeleteLists(maze_display, 1)
+    if maze_mesh is not None: # need to delete previous maze
+        maze_mesh.delete()
+        lights.delete()
+
+    if next_level is None: # first level: nothing was prepared
+        next_level = worker.submit(make_maze, level)
+    if visible_sets is not None: # what was not built of the last level is not needed anymore
+        visible_sets.stop()
+    maze, chunks, lights, spawns, visible_sets = next_level.result()
+    # the visible sets of this level, then the next level, while this one is played
+    worker.submit(visible_sets.build, 0, 1)
+    next_level = worker.submit(make_maze, level+1)
+
+    # the chunks are uploaded during the lift ride
+    maze_mesh = Mesh(chunks, textures['atlas'])
 
     entities = [player]
-    maze, lights, maze_display = make_maze(2 + floor(level/2), 2 + ceil(level/2))
-    send_lists(maze, entities)
+    for spawn, value in spawns:
+        if value == -1:
+            entities.append(Monster(spawn, 'SoldierGun', 50))
+        if value == -2:
+            entities.append(Monster(spawn, 'SoldierShotgun', 100))
 
-    # reset doors
-    doors = [[Vector3(1, 0, 1), -1], [Vector3(len(maze[0])-1, 0, len(maze)-2), -1]]
+    doors = Doors(maze)
+    send_lists(maze, entities, doors)
+
+def apply_quality():
+    # use the settings chosen by the quality controller
+    global render_distance
+    render_distance = quality['render_distance']
+    send_quality(quality['debris'], quality['near'])
 
 def lift(first=False):
-    global lights, door_trigger
-    lights_old = lights[:] # backup them to reuse
+    global lights
+    lights_old = lights # backup them to reuse
 
     # generate a lift
     lift = glGenLists(1)
@@ -325,16 +351,16 @@ def lift(first=False):
     pos = [[(0, 0), (0, 1)], [(1, 0), (1, 1)], [(0, 0), (1, 0)], [(0, 1), (1, 1)]]
 
     # genereate text
-    sizes = [textures['level'][1], textures['0'][1]]
+    sizes = [hud.image_size('level'), hud.image_size('0')]
     w = sizes[0][0] + 10 + sizes[1][0]*len(str(level))
     x = (W-w) // 2
-    text = [(textures['level'][0], x, sizes[0])]
+    text = [('level', x)]
     x += sizes[0][0]+10
     for char in str(level):
-        text.append((textures[char][0], x, sizes[1]))
+        text.append((char, x))
         x += sizes[1][0]
 
-    player.pos = Vector3(player.pos.x%1, floors, player.pos.z%1)
+    player.teleport(Vector3(player.pos.x%1, floors, player.pos.z%1))
     w, h = player.size
     time_passed = 0
     running = True
@@ -362,12 +388,15 @@ def lift(first=False):
         events = pygame.event.get()
         for event in events:
             if event.type == QUIT:
-                pygame.quit()
-                quit()
+                quit_game()
             elif event.type == MOUSEBUTTONDOWN and event.button == 3 and state == 2:
                 running = False
 
-        player.update(events, time_passed, False)
+        with profiler.span('upload'):
+            maze_mesh.upload() # spread the level upload across the ride
+
+        with profiler.span('player'):
+            player.update(events, time_passed, False)
 
         # the player must stay in this cell
         player.pos.x = min(max(player.pos.x, w/2), 1 - w/2)
@@ -379,298 +408,319 @@ def lift(first=False):
             player.cam.y = (floors-1) * (1 + cos(pi * progress))**2 / 4 + h
         else:
             player.cam.y = h
-        lights = [Vector3(0.5, player.cam.y-h+0.7, 0.5)]
+        lights = LightGrid([(0.5, player.cam.y-h+0.7, 0.5)], (1, 1))
 
-        glClear(GL_COLOR_BUFFER_BIT|GL_DEPTH_BUFFER_BIT)
+        with profiler.span('render'):
+            glClear(GL_COLOR_BUFFER_BIT|GL_DEPTH_BUFFER_BIT)
 
-        glPushMatrix()
-        init3d()
+            glPushMatrix()
+            init3d()
 
-        # draw the static lift walls
-        glCallList(lift)
+            # draw the static lift walls
+            glCallList(lift)
 
-        # draw the moving lift walls
-        y = player.cam.y-h
-        for face, tex in [(0, 'liftfloor'), (1, 'liftceil'), (2, 'liftwall'), (3, 'liftwall')]:
-            y0, z0 = pos[face][0]
-            y1, z1 = pos[face][1]
-            glBindTexture(GL_TEXTURE_2D, textures[tex])
-            glBegin(GL_QUADS)
-            glNormal3dv(normals[face])
-            glTexCoord2f(0, 0)
-            glVertex(face == 3, y+y0, z0)
-            glTexCoord2f(1, 0)
-            glVertex(face !=3, y+y0, z0)
-            glTexCoord2f(1, 1)
-            glVertex(face != 3, y+y1, z1)
-            glTexCoord2f(0, 1)
-            glVertex(face == 3, y+y1, z1)
-            glEnd()
+            # draw the moving lift walls
+            y = player.cam.y-h
+            for face, tex in [(0, 'liftfloor'), (1, 'liftceil'), (2, 'liftwall'), (3, 'liftwall')]:
+                y0, z0 = pos[face][0]
+                y1, z1 = pos[face][1]
+                glBindTexture(GL_TEXTURE_2D, textures[tex])
+                glBegin(GL_QUADS)
+                glNormal3dv(normals[face])
+                glTexCoord2f(0, 0)
+                glVertex(face == 3, y+y0, z0)
+                glTexCoord2f(1, 0)
+                glVertex(face !=3, y+y0, z0)
+                glTexCoord2f(1, 1)
+                glVertex(face != 3, y+y1, z1)
+                glTexCoord2f(0, 1)
+                glVertex(face == 3, y+y1, z1)
+                glEnd()
 
-        glPopMatrix()
-        glPushMatrix()
-        init2d()
-        render2d()
+            glPopMatrix()
+            glPushMatrix()
+            init2d()
+            for slot, (image, x) in enumerate(text):
+                hud.rect('text%d' %slot, image, x, H/2 - 100, color=(1, 1, 1, alpha)) # text fade in/out
+            render2d()
+            glPopMatrix()
 
-        y = H/2 - 100
-        glColor4f(1, 1, 1, alpha) # text fade in/out
-        for tex, x, size in text:
-            glBindTexture(GL_TEXTURE_2D, tex)
-            glBegin(GL_QUADS)
-            glTexCoord2f(0, 1)
-            glVertex2f(x, y)
-            glTexCoord2f(1, 1)
-            glVertex2f(x+size[0], y)
-            glTexCoord2f(1, 0)
-            glVertex2f(x+size[0], y + size[1])
-            glTexCoord2f(0, 0)
-            glVertex2f(x, y + size[1])
-            glEnd()
-        glColor(base_color)
+        with profiler.span('wait'):
+            time_passed = clock.tick(FPS) / 1000
+        with profiler.span('flip'):
+            pygame.display.flip()
+        profiler.frame()
 
-        glPopMatrix()
-
-        time_passed = clock.tick(FPS) / 1000
-        pygame.display.flip()
+        if first and 'first frame' not in startup.times:
+            startup.mark('first frame')
+            print('\n'.join(startup.report()))
 
     # prepare for the game
-    player.pos = Vector3(player.pos.x, 0, player.pos.z+1)
+    for slot in range(len(text)):
+        hud.hide('text%d' %slot)
+    maze_mesh.upload(len(maze_mesh.chunks))
+    player.teleport(Vector3(player.pos.x, 0, player.pos.z+1))
     lights = lights_old
 
     # open the door
-    door_trigger = [0, ticks()]
-    door.play()
+    doors.start(0)
 
 def render3d():
-    # draw maze
-    glCallList(maze_display)
-
-    # draw doors
-    for pos, normx in doors:
+    # draw the maze chunks in sight, only with the blocks that can be seen from the camera
+    visible = visible_sets.around(player.cam)
+    if light_shader is not None: # lit per pixel by all the lights around
+        lights.bind(light_shader, player.cam)
+    maze_mesh.render(frustum(), player.cam, render_distance, visible)
+    glUseProgram(0)
+
+    # doors and monsters: drawn together once sorted, with the gate from the level atlas
+    for pos, normx in doors.doors:
         if pos.y == 1:
             continue
-
         z0, z1 = pos.z + (normx == 1), pos.z + (normx == -1)
-        glBindTexture(GL_TEXTURE_2D, textures['gate'])
-        glBegin(GL_QUADS)
-        glNormal3f(normx, 0, 0)
-        glTexCoord2f(0, 0)
-        glVertex(pos.x, pos.y, z0)
-        glTexCoord2f(1, 0)
-        glVertex(pos.x, pos.y, z1)
-        glTexCoord2f(1, 1)
-        glVertex(pos.x, pos.y+1, z1)
-        glTexCoord2f(0, 1)
-        glVertex(pos.x, pos.y+1, z0)
-        glEnd()
-
-    # draw entities last (avoid transparency issues)
+        billboards.add(textures['atlas'], atlas['gate'], (pos.x, pos.y, (z0+z1)/2), (0, 0, (z1-z0)/2), 1, (normx, 0, 0))
+
     for entity in entities:
-        entity.render()
+        if visible is None or visible_sets.sees(visible, entity.pos):
+            entity.render()
+    billboards.render(player.cam)
+
+    # draw other entities last (avoid transparency issues)
     for particle in particles:
         particle.render()
+    debris.render()
 
 def render2d():
-    # render HUD
-    glBindTexture(GL_TEXTURE_2D, hud)
-    glBegin(GL_QUADS)
-
-    glTexCoord2f(0, 1)
-    glVertex2f(0, 0)
-    glTexCoord2f(1, 1)
-    glVertex2f(W, 0)
-    glTexCoord2f(1, 0)
-    glVertex2f(W, H)
-    glTexCoord2f(0, 0)
-    glVertex2f(0, H)
-
-    glEnd()
-
-    # render HP bar
+    # HP bar
     hp = 500*player.hp/player.max_hp
-    glBindTexture(GL_TEXTURE_2D, textures['white'])
-    glBegin(GL_QUADS)
-
-    glColor(0.3, 0.3, 0.3)
-    glTexCoord2f(0, 1)
-    glVertex2f(15, 7)
-    glTexCoord2f(1, 1)
-    glVertex2f(525, 7)
-    glTexCoord2f(1, 0)
-    glVertex2f(515, 33)
-    glTexCoord2f(0, 0)
-    glVertex2f(5, 33)
-
-    glColor(1, 0, 0.2)
-    glTexCoord2f(0, 1)
-    glVertex2f(18, 10)
-    glTexCoord2f(1, 1)
-    glVertex2f(18+hp, 10)
-    glTexCoord2f(1, 0)
-    glVertex2f(10+hp, 30)
-    glTexCoord2f(0, 0)
-    glVertex2f(10, 30)
+    hud.set('hp', 'white', [(18, 10), (18+hp, 10), (10+hp, 30), (10, 30)], (1, 0, 0.2))
 
     if player.dying: # show black fadeout
-        glColor(0.1, 0, 0, (ticks()-player.dying)/1000)
-        glTexCoord2f(0, 1)
-        glVertex2f(0, H)
-        glTexCoord2f(1, 1)
-        glVertex2f(W, H)
-        glTexCoord2f(1, 1)
-        glVertex2f(W, 0)
-        glTexCoord2f(0, 1)
-        glVertex2f(0, 0)
-
-    glEnd()
+        hud.rect('fade', 'white', 0, 0, W, H, (0.1, 0, 0, min((ticks()-player.dying)/1000, 1)))
+    else:
+        hud.hide('fade')
 
     # show low health overlay
     alpha = max(0.5 - player.hp/player.max_hp, 0)*2
     if alpha:
-        glBindTexture(GL_TEXTURE_2D, textures['overlay'])
-        glColor(1, 1, 1, alpha)
-        glBegin(GL_QUADS)
-        glTexCoord2f(0, 1)
-        glVertex(0, 0)
-        glTexCoord2f(1, 1)
-        glVertex(W, 0)
-        glTexCoord2f(1, 0)
-        glVertex(W, H)
-        glTexCoord2f(0, 0)
-        glVertex(0, H)
-        glEnd()
+        hud.rect('overlay', 'overlay', 0, 0, W, H, (1, 1, 1, alpha))
+    else:
+        hud.hide('overlay')
 
-    glColor(base_color)
+    if profiler.enabled:
+        render_profiler()
 
+    hud.render()
+    glColor(base_color)
 
-load_options()
-FOV, render_distance, fullscreen = options['fov'], options['render_distance'], options['fullscreen']
-if options['discord'] == True:
+def render_profiler():
+    # profiler overlay in the top left corner, its image is only updated twice a second
+    global profiler_overlay
+    if profiler_overlay is None or ticks()-profiler_overlay >= 500:
+        surf = pygame.Surface(PROFILER_SIZE, SRCALPHA)
+        lines = profiler.lines()
+        surf.fill((0, 0, 0, 150), (0, 0, PROFILER_SIZE[0], 16*len(lines) + 8))
+        for y, line in enumerate(lines):
+            surf.blit(font.render(line, True, (255, 255, 255)), (4, 4 + 16*y))
+
+        hud.paint('profiler', pygame.image.tostring(surf, 'RGBA', True))
+        hud.rect('profiler', 'profiler', 0, 0)
+        profiler_overlay = ticks()
+
+def connect_discord():
+    # can take long when Discord is not running, returns whether it is connected
+    # runs on its own thread, that needs its own event loop for pypresence
+    global RPC
     try:
+        import asyncio
         from pypresence import Presence
         from time import time
-        RPC = Presence('1077969171591217162')
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        RPC = Presence('1077969171591217162', loop=loop)
         RPC.connect()
         RPC.update(state='In game', start=time(), instance=True, large_image='large_image')
     except: # module not installed or Discord not found
-        options['discord'] = False
-        save_options()
+        return False
+    return True
+
+def load_audio():
+    # music and sounds decoded in the background, returns the sounds used by the game itself
+    pygame.mixer.music.load('files/sfx/music.mp3')
+    pygame.mixer.music.set_volume(0.5)
+    for path in ['files/sfx/%s.wav' %name for name in ['hit', 'death', 'shotgun', 'pistol']] + \
+                ['files/sfx/monsters/%s.wav' %name for name in ['notice', 'death']]:
+        sound(path) # shared by the player and the monsters
+    return [sound('files/sfx/%s.wav' %name) for name in ['lifton', 'liftoff', 'door', 'bullet']]
+
+def open_window():
+    global W, H, screen
+    if fullscreen:
+        info = pygame.display.Info()
+        W, H = info.current_w, info.current_h
+        screen = pygame.display.set_mode((W, H), HWSURFACE|OPENGL|DOUBLEBUF|FULLSCREEN)
+    else:
+        W, H = 900, 500
+        screen = pygame.display.set_mode((W, H), HWSURFACE|OPENGL|DOUBLEBUF)
+    pygame.display.set_caption('Maze')
+    pygame.display.set_icon(pygame.image.load('files/textures/icon.png'))
+    pygame.event.set_grab(1) # lock all events to this window
+    pygame.mouse.set_visible(0)
+
+def init_gl():
+    global light_shader
+    initOpenGl()
+
+    light_shader = None
+    if options['clustered_lights']:
+        try:
+            light_shader = light_program()
+        except Exception as e: # shaders not supported
+            print('Error compiling the lighting shader:')
+            print(type(e), e)
+            options['clustered_lights'] = False
+            save_options()
 
-pygame.init()
-if fullscreen:
-    info = pygame.display.Info()
-    W, H = info.current_w, info.current_h
-    screen = pygame.display.set_mode((W, H), HWSURFACE|OPENGL|DOUBLEBUF|FULLSCREEN)
-else:
-    W, H = 900, 500
-    screen = pygame.display.set_mode((W, H), HWSURFACE|OPENGL|DOUBLEBUF)
-pygame.display.set_caption('Maze')
-pygame.display.set_icon(pygame.image.load('files/textures/icon.png'))
-pygame.event.set_grab(1) # lock all events to this window
-pygame.mouse.set_visible(0)
-clock = pygame.time.Clock()
-ticks = pygame.time.get_ticks
 
-# music
-pygame.mixer.music.load('files/sfx/music.mp3')
-pygame.mixer.music.set_volume(0.5)
-lifton, liftoff, door, bullet = [pygame.mixer.Sound('files/sfx/%s.wav' %name) for name in ['lifton', 'liftoff', 'door', 'bullet']]
+load_options()
+FOV, render_distance, fullscreen = options['fov'], options['render_distance'], options['fullscreen']
+profiler.enabled = options['profiler']
+step = 1/options['tick_rate'] # duration of a step of the simulation
 
-door_trigger = None # used for door animations
-doors = None # start and exit doors: [pos, normal x]
+brain = None # monsters decisions made in another process
+if options['ai_process']:
+    try:
+        brain = Brain() # before the window and the threads are made, not to copy them
+    except ValueError: # no fork on Windows: the monsters decide in this process
+        options['ai_process'] = False
+        save_options()
+send_brain(brain)
+
+doors = None # start and exit doors
+profiler_overlay = None # last update
+PROFILER_SIZE = (330, 16*9 + 8) # room for profiler.lines()
 time_passed = 0
-FPS = 120
+lag = 0 # time not simulated yet
+pending = [] # events not handled by the simulation yet
+FPS = max(120, options['target_fps']) # rendering, independent from the simulation
+FOG = 0.2 # density at the render distance of the options
 level = 0
-maze_display = None
+game_seed = options['seed'] or randrange(1, 2**40) # every level is made from it
+maze_mesh = None
+visible_sets = None
+next_level = None # future of the next level data
+worker = ThreadPoolExecutor(1)
+gen_pool = None # processes generating the tiles of the biggest mazes
+if options['gen_workers'] > 1:
+    try:
+        # the workers must not run this file again, as they would when spawned
+        gen_pool = ProcessPoolExecutor(options['gen_workers'], get_context('fork'))
+        gen_pool.submit(int).result() # fork them all now, before the window and the threads are made
+    except ValueError: # no fork on Windows: the tiles are generated one after the other in this process
+        pass
 base_color = (1, 1, 1)
-initOpenGl()
-
 walls_names = ['bricks', 'slimybricks', 'ironplates', 'concrete']
 monsters_names = [('SoldierGun', 'POSS'), ('SoldierShotgun', 'SPOS')]
-init_tex() # generate all textures
-hud_surf = pygame.Surface((W, H), SRCALPHA)
-crosshair = pygame.image.load('files/textures/crosshair.png')
-w, h = crosshair.get_size()
-hud_surf.blit(crosshair, ((W-w) // 2, (H-h) // 2))
-update_hud(True)
+try:
+    texture_pack = TexturePack()
+except (OSError, ValueError): # not built
+    texture_pack = None
+
+pygame.init()
+clock = pygame.time.Clock()
+ticks = pygame.time.get_ticks
+
+# everything until the first frame: Discord, the audio, the images and the first level on threads,
+# the window and what uses OpenGL on this thread, as soon as what they need is ready
+startup = Startup()
+if options['discord'] == True:
+    startup.add('discord', connect_discord) # never waited for
+startup.add('audio', load_audio)
+startup.add('font', lambda: pygame.font.SysFont('monospace', 14)) # profiler overlay
+startup.add('flats', read_flats)
+startup.add('atlas', pack_flats, 'flats')
+startup.add('level', lambda data: make_maze(1), 'atlas')
+startup.add('sprites', read_sprites)
+startup.add('hud', read_hud)
+next_level = startup.futures['level'] # used by the first new_level
+
+startup.run('window', open_window)
+startup.run('opengl', init_gl)
+startup.run('textures', init_tex, 'flats', 'atlas', 'sprites', 'hud')
+startup.run('hud upload', init_hud, 'hud')
+font = startup.result('font')
+lifton, liftoff, door, bullet = startup.result('audio')
+
+# settings lowered to hold the target frame rate, the least visible first
+distance = options['render_distance']
+knobs = [('debris', [10, 6, 3, 1]), ('lights', [3, 2, 1, 0]), ('near', [Scheduler.near, 6, 4]),
+         ('render_distance', sorted({max(round(distance*scale), 4) for scale in [1, 0.8, 0.6, 0.45]}, reverse=True))]
+if light_shader is not None: # the shader uses all the lights of the clusters
+    del knobs[1]
+if options['target_fps']:
+    quality = Quality(knobs, 1000/options['target_fps'], open('files/quality.log', 'w'))
+else:
+    quality = Quality(knobs)
+apply_quality()
 
 send_tex(textures)
 
-particles = []
+particles = [] # bullets
+debris = Particles()
 player = Player()
 entities = [player]
 
-new_level()
-send_vars(W, H, ticks, player, particles, bullet, options)
+send_vars(W, H, ticks, player, particles, debris, bullet, door, options)
+startup.run('new level', new_level)
 lift(True)
 
 while True:
-    events = pygame.event.get()
+    with profiler.span('events'):
+        events = pygame.event.get()
     for event in events:
         if event.type == QUIT:
-            pygame.quit()
-            quit()
+            quit_game()
         elif event.type == MOUSEBUTTONDOWN:
             pygame.event.set_grab(1) # refresh mouse grab
         elif event.type == USEREVENT: # exit door opened
-            door_trigger = [1, ticks()]
-            door.play()
-
-            maze[-2][-1] = 0 # allow the player to walk into the exit
-
-    for entity in entities:
-        if entity == player:
-            player.update(events, time_passed)
-        elif entity.pos.distance_to(player.pos) <= 8: # simulation distance
-            entity.update(time_passed)
-    for particle in particles:
-        particle.update(time_passed)
+            doors.start(1)
+            set_block(-1, -2, 0) # allow the player to walk into the exit
+
+    # run the simulation at a fixed rate, whatever the frame rate
+    lag = min(lag+time_passed, 0.25) # give up catching up after very long frames
+    pending += events
+    while lag >= step:
+        lag -= step
+        with profiler.span('tick'):
+            finished = tick(pending, step)
+        pending = []
+        if finished: # exit door closed
+            new_level()
+            lift()
+            lag = 0
+            quality.reset()
+    interpolate(lag/step)
 
     glClear(GL_COLOR_BUFFER_BIT|GL_DEPTH_BUFFER_BIT)
 
     # render 3d elements
-    glPushMatrix()
-    init3d()
-    render3d()
-    glPopMatrix()
+    with profiler.span('render3d'):
+        glPushMatrix()
+        init3d()
+        render3d()
+        glPopMatrix()
 
     # render 2d elements
-    glPushMatrix()
-    init2d()
-    render2d()
-    glPopMatrix()
-
-    if door_trigger:
-        index, when = door_trigger
-        progress = (ticks()-when)/400
-
-        if progress > 1: # the door is fully opened
-            if index == 0: # entrance door opened
-                door_trigger = None
-                doors[0][0].y = 1
-                maze[1][1] = 0 # allow to go in the maze
-
-            elif index == 1: # exit door opened
-                doors[1][0].y = 1
-                if player.pos.x - player.size[0]/2 > len(maze[0])-1: # if player is in the lift
-                    # close the exit door
-                    door_trigger = [2, ticks()]
-                    door.play()
-
-                    doors[1][1] = 1 # the door will face the player
-                    maze[-2][-2] = 1 # prevent the player from going back in the maze
-
-            elif index == 2: # exit door closed
-                new_level()
-                lift()
-
-        else: # door animation
-            if index == 0: # start door opening
-                doors[0][0].y = progress
-            elif index == 1: # exit door opening
-                doors[1][0].y = progress
-            elif index == 2: # exit door closing
-                doors[1][0].y = 1-progress
-
-    time_passed = clock.tick(FPS) / 1000
-    pygame.display.flip()
+    with profiler.span('render2d'):
+        glPushMatrix()
+        init2d()
+        render2d()
+        glPopMatrix()
+
+    with profiler.span('wait'):
+        time_passed = clock.tick(FPS) / 1000
+    if quality.frame(clock.get_rawtime(), time_passed*1000): # a setting changed
+        apply_quality()
+    with profiler.span('flip'):
+        pygame.display.flip()
+    profiler.frame()
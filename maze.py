@@ -1,89 +1,214 @@
-from random import randint, choice
-
-def neighbors(maze, X, Y, n, m):
-    # returns unvisited neighbors of a cell at pos X, Y
-    N = []
-    for x, y, count in [(X, Y-1, 0), (X+1, Y, 1), (X, Y+1, 2), (X-1, Y, 3)]:
-        if 0 <= x < m and 0 <= y < n and not maze[y][x][4]:
-            N.append([(x, y), count]) # position in the maze, neighbor index
-    return N
-
-def gen(n, m):
-    # generates a maze with n lines and m columns
-
-    # [N, E, S, W, cell value]
-    maze = [[[1, 1, 1, 1, 0] for _ in range(m)] for _ in range(n)]
-    maze[0][0][3] = maze[n-1][m-1][1] = 0 # open goal
-
-    # push a random cell in the stack
-    free = [(x, y) for x in range(m) for y in range(n) if not maze[y][x][4]]
-    pos = choice(free) # current cell
+import numpy as np
+
+from math import ceil
+from random import Random
+
+# one bit per wall in every cell of the maze
+N, E, S, W = 1, 2, 4, 8
+WALLS = [N, E, S, W] # opposite walls are 2 indices apart
+TILE = 256 # size of the tiles of gen_tiled, in cells
+
+def gen(n, m, rand=None, goals=True):
+    # generates a maze with n lines and m columns, rand: random.Random to get the same maze again
+    # every cell is one byte holding its walls, stored line after line
+    # goals: whether to open the start and exit walls, in the top left and bottom right corners
+    randrange = (rand or Random()).randrange
+    walls = bytearray([N|E|S|W]) * (n*m)
+    visited = bytearray(n*m)
+    if goals:
+        walls[0] &= ~W # open goal
+        walls[-1] &= ~E
+
+    # start from a random cell
+    pos = randrange(n*m)
+    visited[pos] = 1
     stack = [pos] # previously visited cells
 
-    while len(stack):
-        x, y = pos
-        maze[y][x][4] = 1 # cell has been visited
+    # unvisited neighbors of the current cell: reused to avoid allocations
+    free, sides = [0]*4, [0]*4
 
-        # get unvisited neighbors
-        N = neighbors(maze, x, y, n, m)
-        if len(N):
-            # mark this cell as visited
-            maze[y][x][4] = 1
+    while stack:
+        pos = stack[-1]
+        x, y = pos%m, pos//m
 
+        # get unvisited neighbors: cell index and wall of this cell leading to it
+        count = 0
+        if y and not visited[pos-m]:
+            free[count], sides[count] = pos-m, 0
+            count += 1
+        if x < m-1 and not visited[pos+1]:
+            free[count], sides[count] = pos+1, 1
+            count += 1
+        if y < n-1 and not visited[pos+m]:
+            free[count], sides[count] = pos+m, 2
+            count += 1
+        if x and not visited[pos-1]:
+            free[count], sides[count] = pos-1, 3
+            count += 1
+
+        if count:
             # if neighbors, choose a random one and open the way
-            pos_, index = choice(N)
-            x_, y_ = pos_
-            index_ = {0: 2, 1: 3, 2: 0, 3: 1}[index]
-            maze[y][x][index] = 0
-            maze[y_][x_][index_] = 0
-
-            # add the current pos to the stack and continue with the neighbor
-            stack.append(pos)
-            pos = (x_, y_)
+            index = randrange(count)
+            pos_, side = free[index], sides[index]
+            walls[pos] &= ~WALLS[side]
+            walls[pos_] &= ~WALLS[side ^ 2]
+
+            # continue with the neighbor
+            visited[pos_] = 1
+            stack.append(pos_)
         else:
             # go back to the previous cell if not free neighbors
-            pos = stack.pop()
+            stack.pop()
 
-    return maze
+    return np.frombuffer(walls, np.uint8).reshape(n, m)
 
-def to_blocks(maze, max_wall):
-    # convert a maze with walls to an array of 1s or 0s
-    new = []
-    m, n = len(maze[0])*2 + 1, len(maze)*2 + 1
-    for y in range(n):
-        new.append([])
-        for x in range(m):
-            if x%2 and y%2:
-                new[-1].append(0) # maze cells
-            elif not x%2 and not y%2: # corner touching 4 cells
-                new[-1].append(1)
-            elif x%2: # horizontal walls
-                if y == n-1: # bottom wall
-                    new[-1].append(maze[y//2 - 1][x//2][2])
-                else: # use top walls of cells
-                    new[-1].append(maze[y//2][x//2][0])
-            else: # vertical walls
-                if x == m-1: # right wall
-                    new[-1].append(maze[y//2][x//2 - 1][1])
-                else: # use left walls of cells
-                    new[-1].append(maze[y//2][x//2][3])
-
-    # attibute random values to choose textures
-    for y in range(n):
-        for x in range(m):
-            if new[y][x] == 1:
-                # random texture
-                value = 0
-                again = True
-                while again and value < max_wall:
-                    value += 1
-                    again = not randint(0, 3)
-                new[y][x] = value
-            elif (x, y) not in  [(0, 1), (1, 1)]:
-                # random mob
-                if not randint(0, 8):
-                    if randint(0, 2):
-                        new[y][x] = -1
-                    else:
-                        new[y][x] = -2
+def gen_tile(args):
+    # one tile of gen_tiled, run in the worker processes
+    n, m, seed = args
+    return gen(n, m, Random(seed), False)
+
+def gen_tiled(n, m, rand=None, tile=TILE, executor=None):
+    # same as gen, but the maze is made of tiles of tile x tile cells generated independently
+    # then joined into one maze by opening one wall between the tiles linked by a random spanning tree
+    # executor: concurrent.futures executor (a process pool) generating the tiles, else done one after the other
+    # the result only depends on rand, whatever the executor
+    rand = rand or Random()
+    ty, tx = ceil(n/tile), ceil(m/tile)
+    tasks = [(min(tile, n - y*tile), min(tile, m - x*tile), rand.getrandbits(64)) for y in range(ty) for x in range(tx)]
+
+    walls = np.empty((n, m), np.uint8)
+    tiles = map(gen_tile, tasks) if executor is None else executor.map(gen_tile, tasks)
+    for index, maze in enumerate(tiles):
+        y, x = index//tx * tile, index%tx * tile
+        walls[y:y+tile, x:x+tile] = maze
+
+    # the spanning tree is a maze of the tiles: join the tiles where its walls are open
+    tree = gen(ty, tx, rand, False)
+    for y, x in np.argwhere(~tree & E):
+        z = rand.randrange(y*tile, min((y+1)*tile, n))
+        walls[z, (x+1)*tile - 1] &= ~np.uint8(E)
+        walls[z, (x+1)*tile] &= ~np.uint8(W)
+    for y, x in np.argwhere(~tree & S):
+        x_ = rand.randrange(x*tile, min((x+1)*tile, m))
+        walls[(y+1)*tile - 1, x_] &= ~np.uint8(S)
+        walls[(y+1)*tile, x_] &= ~np.uint8(N)
+
+    walls[0, 0] &= ~np.uint8(W) # open goal
+    walls[-1, -1] &= ~np.uint8(E)
+    return walls
+
+def to_blocks(maze, max_wall, rng=None):
+    # convert a maze with walls to an array of 1s or 0s, rng: numpy Generator for the decoration
+    n, m = maze.shape
+    new = np.ones((n*2 + 1, m*2 + 1), np.int8) # corners touching 4 cells stay 1
+
+    new[1::2, 1::2] = 0 # maze cells
+    new[:-1:2, 1::2] = maze & N > 0 # horizontal walls: use top walls of cells
+    new[-1, 1::2] = maze[-1] & S > 0 # bottom wall
+    new[1::2, :-1:2] = maze & W > 0 # vertical walls: use left walls of cells
+    new[1::2, -1] = maze[:, -1] & E > 0 # right wall
+
+    decorate(new, max_wall, rng=rng)
     return new
+
+def decorate(blocks, max_wall, top=0, rng=None):
+    # attibute random values to choose textures, in lines of blocks starting at line top
+    rng = rng or np.random.default_rng()
+    walls = np.flatnonzero(blocks == 1)
+    for _ in range(max_wall-1):
+        # each texture has 1 chance in 4 to move on to the next one
+        walls = walls[rng.integers(0, 4, len(walls), np.uint8) == 0]
+        blocks.flat[walls] += 1
+
+    # random mobs
+    free = blocks == 0
+    if top <= 1 < top+len(blocks):
+        free[1-top, :2] = False # not in the start lift or in front of it
+    mobs = np.flatnonzero(free & (rng.integers(0, 9, free.shape, np.uint8) == 0))
+    blocks.flat[mobs] = np.where(rng.integers(0, 3, len(mobs), np.uint8) > 0, -1, -2)
+
+def gen_rows(n, m, rand=None):
+    # generates a maze with n lines (endless if n is None) and m columns, one line at a time
+    # Eller's algorithm: only the sets of cells of the current line are kept
+    rand = rand or Random()
+    sets = list(range(m)) # set of every cell in the line
+    members = {x: [x] for x in range(m)} # cells in every set
+    label = m # next unused set
+    above = None
+
+    y = 0
+    while n is None or y < n:
+        last = n is not None and y == n-1
+        row = bytearray([N|E|S|W]) * m
+        if above is None:
+            row[0] &= ~W # open goal
+        else: # follow the ways down from the previous line
+            for x in range(m):
+                if not above[x] & S:
+                    row[x] &= ~N
+
+        # randomly join adjacent cells, or all of them on the last line
+        for x in range(m-1):
+            a, b = sets[x], sets[x+1]
+            if a != b and (last or rand.randrange(2)):
+                row[x] &= ~E
+                row[x+1] &= ~W
+
+                # merge the smallest set into the other one
+                if len(members[a]) < len(members[b]):
+                    a, b = b, a
+                for x_ in members[b]:
+                    sets[x_] = a
+                members[a] += members.pop(b)
+
+        if last:
+            row[-1] &= ~E # open goal
+            yield np.frombuffer(row, np.uint8)
+            return
+
+        # every set needs at least one way down
+        for cells in members.values():
+            down = [x for x in cells if rand.randrange(2)] or [rand.choice(cells)]
+            for x in down:
+                row[x] &= ~S
+
+        yield np.frombuffer(row, np.uint8)
+
+        # cells without a way down start a new set on the next line
+        members = {}
+        for x in range(m):
+            if row[x] & S:
+                sets[x] = label
+                label += 1
+            members.setdefault(sets[x], []).append(x)
+
+        above = row
+        y += 1
+
+def to_blocks_rows(rows, max_wall, rng=None):
+    # streaming to_blocks: turns every line of cells into its lines of blocks as it arrives
+    rng = rng or np.random.default_rng()
+    for y, row in enumerate(rows):
+        m = len(row)
+        new = np.ones((2 + (not y), m*2 + 1), np.int8)
+        if not y: # top wall
+            new[0, 1::2] = row & N > 0
+
+        new[-2, 1::2] = 0 # maze cells
+        new[-2, :-1:2] = row & W > 0 # vertical walls: use left walls of cells
+        new[-2, -1] = row[-1] & E > 0 # right wall
+        new[-1, 1::2] = row & S > 0 # horizontal walls: use bottom walls of cells
+
+        decorate(new, max_wall, y*2 + (y > 0), rng)
+        yield from new
+
+def chunks(rows, size):
+    # group streamed lines of blocks into arrays of (at most) size lines
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield np.array(chunk)
+            chunk = []
+    if chunk:
+        yield np.array(chunk)
@@ -0,0 +1,197 @@
+import ctypes
+import numpy as np
+
+from OpenGL.GL import *
+
+CHUNK = 16 # size of the chunks of the level mesh, in blocks
+
+# textures used by the level on top of the walls textures
+FLATS = ['liftwall', 'floor', 'mossyfloor', 'ceil', 'lightceil', 'liftfloor', 'liftceil', 'lifthidden']
+
+# walls: N, E, S, W
+NORMALS = [(0, 0, -1), (1, 0, 0), (0, 0, 1), (-1, 0, 0)]
+# positions are inverted because we are seeing the outside of the cubes
+OFFSET = [[(1, 0), (0, 0)], [(1, 1), (1, 0)], [(0, 1), (1, 1)], [(0, 0), (0, 1)]]
+UV = [(0, 0), (1, 0), (1, 1), (0, 1)]
+
+def faces(x, z, corners, normal, uv=UV):
+    # quads at the blocks x, z: corners are the (x, y, z) offsets of their 4 vertices
+    # every vertex is interleaved as GL_T2F_N3F_V3F: texture coordinates, normal, position
+    quads = np.empty((len(x), 4, 8), np.float32)
+    quads[:, :, :2] = uv
+    quads[:, :, 2:5] = normal
+    quads[:, :, 5:] = corners
+    quads[:, :, 5] += x[:, None]
+    quads[:, :, 7] += z[:, None]
+    return quads
+
+def random_flats(count, rng=None):
+    # random floor and ceiling textures of count air blocks: which floors are mossy and which ceilings are lights
+    rng = rng or np.random.default_rng()
+    return rng.integers(0, 5, count) == 0, rng.integers(0, 9, count) == 0
+
+def level_quads(maze, walls_names, flats=None):
+    # build all the quads of a maze of blocks, flats: decoration of the air blocks (random if not given)
+    # returns the quads, their textures (indices in names), names and where the ceiling lights are
+    names = walls_names+FLATS
+    n, m = maze.shape
+    quads, tex = [], []
+
+    # walls: only draw the faces next to air (outside of the maze is air)
+    solid = np.pad(maze > 0, 1)
+    walls = np.array(maze-1, np.int16) # "normal" wall texture
+    for x, z in [(0, 1), (m-1, n-2)]: # next to lift: lift wall textures
+        for x_, z_ in [(x, z-1), (x+1, z), (x, z+1), (x-1, z)]:
+            if 0 <= x_ < m and 0 <= z_ < n:
+                walls[z_, x_] = names.index('liftwall')
+
+    for face, (dx, dz) in enumerate([(0, -1), (1, 0), (0, 1), (-1, 0)]):
+        visible = solid[1:-1, 1:-1] & ~solid[1+dz:n+1+dz, 1+dx:m+1+dx]
+        z, x = np.nonzero(visible)
+        a, b = OFFSET[face]
+        corners = [(a[0], 0, a[1]), (b[0], 0, b[1]), (b[0], 1, b[1]), (a[0], 1, a[1])]
+        quads.append(faces(x, z, corners, NORMALS[face]))
+        tex.append(walls[z, x])
+
+    # floor and ceiling: only add them if visible
+    z, x = np.nonzero(maze <= 0)
+    mossy, lit = random_flats(len(x)) if flats is None else flats
+    floors = np.where(mossy, names.index('mossyfloor'), names.index('floor'))
+    ceils = np.where(lit, names.index('lightceil'), names.index('ceil'))
+    for x_, z_ in [(0, 1), (m-1, n-2)]: # lift
+        lift = (x == x_) & (z == z_)
+        floors[lift] = names.index('liftfloor')
+        ceils[lift] = names.index('liftceil')
+
+    for y, normal, textures in [(0, 1, floors), (1, -1, ceils)]:
+        corners = [(dx, y, dz) for dx, dz in UV]
+        quads.append(faces(x, z, corners, (0, normal, 0), UV))
+        tex.append(textures)
+
+    lights = ceils != names.index('ceil')
+    lights = np.stack([x[lights], z[lights]], 1)
+
+    # lift walls leading to outside of the maze
+    for x_, z0, z1 in [(0, 2, 1), (m, n-2, n-1)]:
+        corners = [(0, y, [z0, z1][dz]) for y, dz in UV]
+        uv = [(dz, y) for y, dz in UV]
+        quads.append(faces(np.array([x_]), np.array([0]), corners, (z0-z1, 0, 0), uv))
+        tex.append([names.index('lifthidden')])
+
+    return np.concatenate(quads), np.concatenate(tex), names, lights
+
+def to_atlas(quads, tex, names, rects):
+    # move the texture coordinates of the quads into their (u0, v0, u1, v1) rectangles in the atlas
+    rects = np.array([rects[name] for name in names], np.float32)[tex][:, None]
+    quads[:, :, 0] = rects[..., 0] + quads[:, :, 0]*(rects[..., 2]-rects[..., 0])
+    quads[:, :, 1] = rects[..., 1] + quads[:, :, 1]*(rects[..., 3]-rects[..., 1])
+    return quads
+
+def blocks_of(quads, shape):
+    # index (line after line) of the block every quad belongs to: walls belong to their solid block
+    # and flats to their air block, found half a block behind the quad
+    center = quads[:, :, 5:].mean(1) - quads[:, 0, 2:5]/2
+    n, m = shape
+    x = np.clip(np.floor(center[:, 0]), 0, m-1).astype(int)
+    z = np.clip(np.floor(center[:, 2]), 0, n-1).astype(int)
+    return z*m + x
+
+def split(quads, shape):
+    # sort the quads by chunk then by block, shape: of the maze
+    # returns [vertices, box, block of every quad] for every chunk
+    blocks = blocks_of(quads, shape)
+    x, z = blocks % shape[1] // CHUNK, blocks // shape[1] // CHUNK
+    key = z*(x.max()+1) + x
+    order = np.lexsort([blocks, key])
+    quads, key, blocks = quads[order], key[order], blocks[order]
+
+    chunks = []
+    bounds = np.flatnonzero(np.diff(key))+1
+    for start, end in zip([0, *bounds], [*bounds, len(key)]):
+        vertices = quads[start:end].reshape(-1, 8)
+        box = np.array([vertices[:, 5:].min(0), vertices[:, 5:].max(0)])
+        chunks.append([vertices, box, blocks[start:end]])
+
+    return chunks
+
+def frustum():
+    # planes (a, b, c, d) of the current camera frustum, facing inwards
+    # OpenGL matrices are column major: read them transposed
+    projection = glGetFloatv(GL_PROJECTION_MATRIX)
+    modelview = glGetFloatv(GL_MODELVIEW_MATRIX)
+    clip = (modelview @ projection).T
+    return np.array([clip[3]+clip[0], clip[3]-clip[0], # left, right
+                     clip[3]+clip[1], clip[3]-clip[1], # bottom, top
+                     clip[3]+clip[2], clip[3]-clip[2]]) # near, far
+
+class Mesh:
+    # static level geometry: one vertex buffer, textured from the atlas, drawn by chunks or by blocks
+    def __init__(self, chunks, texture):
+        self.texture = texture
+        counts = [len(vertices) for vertices, _, _ in chunks]
+        self.counts = np.array(counts, np.int32)
+        self.firsts = np.array(np.cumsum([0]+counts[:-1]), np.int32)
+
+        # every block is drawn from one range of the buffer
+        blocks = np.concatenate([blocks for _, _, blocks in chunks])
+        self.blocks, first, count = np.unique(blocks, return_index=True, return_counts=True)
+        self.block_firsts, self.block_counts = (first*4).astype(np.int32), (count*4).astype(np.int32)
+        self.block_chunks = np.searchsorted(self.firsts, self.block_firsts, 'right')-1
+
+        # the buffer is filled later, chunk by chunk
+        self.chunks = [vertices for vertices, _, _ in chunks]
+        self.uploaded = 0
+        self.buffer = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.buffer)
+        glBufferData(GL_ARRAY_BUFFER, sum(vertices.nbytes for vertices in self.chunks), None, GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        boxes = np.array([box for _, box, _ in chunks])
+        self.low, self.high = boxes[:, 0], boxes[:, 1]
+
+    def upload(self, count=1):
+        # send the next count chunks to the buffer, returns True once they are all uploaded
+        glBindBuffer(GL_ARRAY_BUFFER, self.buffer)
+        for chunk in range(self.uploaded, min(self.uploaded+count, len(self.chunks))):
+            vertices = self.chunks[chunk]
+            glBufferSubData(GL_ARRAY_BUFFER, int(self.firsts[chunk])*vertices.itemsize*8, vertices.nbytes, vertices)
+            self.chunks[chunk] = None # not needed anymore
+            self.uploaded += 1
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        return self.uploaded == len(self.chunks)
+
+    def visible(self, planes, eye, distance):
+        # chunks intersecting the frustum and closer than distance to the eye
+        # a box is outside as soon as its nearest corner to a plane is behind it
+        normals = planes[:, :3]
+        corners = np.where(normals >= 0, self.high[:, None], self.low[:, None])
+        inside = ((corners*normals).sum(2) + planes[:, 3] >= 0).all(1)
+
+        nearest = np.clip(eye, self.low, self.high)
+        return inside & (((nearest-eye)**2).sum(1) <= distance**2)
+
+    def render(self, planes, eye, distance, blocks=None):
+        # a single draw call for all the chunks in sight
+        # blocks: which blocks can be seen (flat boolean array), to only draw them in these chunks
+        visible = self.visible(planes, np.array(eye), distance)
+        visible[self.uploaded:] = False
+        if blocks is None:
+            firsts, counts = self.firsts[visible], self.counts[visible]
+        else:
+            drawn = visible[self.block_chunks] & blocks[self.blocks]
+            firsts, counts = self.block_firsts[drawn], self.block_counts[drawn]
+        if not len(firsts):
+            return
+
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glBindBuffer(GL_ARRAY_BUFFER, self.buffer)
+        glInterleavedArrays(GL_T2F_N3F_V3F, 0, ctypes.c_void_p(0))
+        glMultiDrawArrays(GL_QUADS, firsts, counts, len(firsts))
+
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        for array in [GL_VERTEX_ARRAY, GL_NORMAL_ARRAY, GL_TEXTURE_COORD_ARRAY]:
+            glDisableClientState(array)
+
+    def delete(self):
+        glDeleteBuffers(1, [self.buffer])
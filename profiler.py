@@ -0,0 +1,88 @@
+import numpy as np
+
+from time import perf_counter
+from threading import current_thread, main_thread
+from collections import deque
+from contextlib import contextmanager
+
+class Profiler:
+    # time spent in named spans of code, gathered frame by frame
+    # the spans timed on other threads (levels made in the background) are kept apart, as they don't slow the frames
+    def __init__(self, window=600, history=36000):
+        self.enabled = False
+        self.spans = {} # current frame
+        self.times = deque(maxlen=window) # last frame times (s), for the percentiles
+        self.recent = deque(maxlen=window) # spans of the last frames
+        self.records = deque(maxlen=history) # [start, frame time, spans] of the last frames, for the CSV
+        self.background = deque(maxlen=history) # spans of the other threads: [start, time, thread, name]
+        self.start = self.last = perf_counter()
+
+    @contextmanager
+    def span(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            thread = current_thread()
+            if thread is main_thread():
+                self.spans[name] = self.spans.get(name, 0) + perf_counter()-start
+            else:
+                self.background.append([start-self.start, perf_counter()-start, thread.name, name])
+
+    def frame(self):
+        # end the current frame, at the end of every iteration of a main loop
+        now = perf_counter()
+        if self.enabled:
+            self.times.append(now-self.last)
+            self.recent.append(self.spans)
+            self.records.append([self.last-self.start, now-self.last, self.spans])
+        self.spans = {}
+        self.last = now
+
+    def reset(self):
+        self.spans = {}
+        self.times.clear()
+        self.recent.clear()
+        self.records.clear()
+        self.background.clear()
+        self.start = self.last = perf_counter()
+
+    def percentiles(self, ranks=(50, 95, 99)):
+        # rolling percentiles of the frame time (s)
+        if not self.times:
+            return [0]*len(ranks)
+        return list(np.percentile(self.times, ranks))
+
+    def averages(self):
+        # mean time per frame of every span over the last frames (s), longest first
+        total = {}
+        for spans in self.recent:
+            for name, time in spans.items():
+                total[name] = total.get(name, 0) + time
+        return sorted([(name, time/len(self.recent)) for name, time in total.items()], key=lambda span: -span[1])
+
+    def lines(self, count=8):
+        # text for the overlay
+        p50, p95, p99 = self.percentiles()
+        lines = ['frame  p50 %.1f  p95 %.1f  p99 %.1f ms' %(p50*1e3, p95*1e3, p99*1e3)]
+        return lines + ['%-16s %6.2f ms' %(name, time*1e3) for name, time in self.averages()[:count]]
+
+    def dump(self, path):
+        # write every recorded frame as a line of CSV, times in ms
+        # then the spans of the other threads, one per line without a frame time
+        names = sorted({name for _, _, spans in self.records for name in spans}
+                       | {name for _, _, _, name in self.background})
+        with open(path, 'w') as f:
+            f.write(','.join(['time', 'thread', 'frame']+names) + '\n')
+            for start, time, spans in self.records:
+                f.write(','.join(['%.3f' %(start*1e3), 'main', '%.3f' %(time*1e3)]
+                                 + ['%.3f' %(spans.get(name, 0)*1e3) for name in names]) + '\n')
+            for start, time, thread, span in self.background:
+                f.write(','.join(['%.3f' %(start*1e3), thread, '']
+                                 + ['%.3f' %(time*1e3) if name == span else '' for name in names]) + '\n')
+
+profiler = Profiler()
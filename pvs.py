@@ -0,0 +1,119 @@
+import numpy as np
+
+from math import floor, ceil
+
+# potentially visible sets: which blocks can be seen from every air block of a level
+# the openings between neighbor air blocks are the portals: the set grows through them from the block of the camera,
+# a block being visible if a line from the camera block reaches it without crossing a wall
+
+OFFSETS = np.array([0.001, 0.5, 0.999]) # sample points in the blocks, along each axis
+STEP = 0.2 # between the samples along the lines, in blocks
+
+class VisibleSets:
+    # the sets are computed by build in the background, or else the first time the camera enters a block,
+    # and stored as bitsets of their bounding box
+    def __init__(self, maze, distance):
+        # maze: level blocks with the doors open, distance: farther blocks are never visible
+        self.solid = maze > 0
+        self.distance = distance
+        self.sets = {} # index of the block: (x0, z0, w, h, bits)
+        self.last = None # (index, visible blocks) of the last camera block
+        self.stopped = False # level finished: no more sets to build
+
+        sx, sz = np.meshgrid(OFFSETS, OFFSETS)
+        self.samples = np.stack([sx.ravel(), sz.ravel()], 1)
+
+    def build(self, x, z, radius=None):
+        # compute the sets of the air blocks, the nearest to the block x, z first, up to radius blocks when given
+        # a few ms each: too long to wait for while rendering a frame, and for all of them when changing level
+        m = self.solid.shape[1]
+        blocks = np.argwhere(~self.solid)
+        distances = ((blocks - (z, x))**2).sum(1)
+        if radius is not None:
+            blocks, distances = blocks[distances <= radius**2], distances[distances <= radius**2]
+        for z_, x_ in blocks[np.argsort(distances, kind='stable')]:
+            if self.stopped:
+                return
+            if z_*m + x_ not in self.sets:
+                self.sets[z_*m + x_] = self.compute(x_, z_)
+
+    def stop(self):
+        self.stopped = True
+
+    def around(self, pos):
+        # visible blocks from pos as a flat boolean array (line after line), None if outside of the level
+        n, m = self.solid.shape
+        x, z = floor(pos.x), floor(pos.z)
+        if not (0 <= x < m and 0 <= z < n):
+            return None
+
+        index = z*m + x
+        if self.last is None or self.last[0] != index:
+            if index not in self.sets:
+                self.sets[index] = self.compute(x, z)
+            x0, z0, w, h, bits = self.sets[index]
+            visible = np.zeros((n, m), bool)
+            visible[z0:z0+h, x0:x0+w] = np.unpackbits(bits, count=w*h).reshape(h, w)
+            self.last = (index, visible.ravel())
+        return self.last[1]
+
+    def sees(self, visible, pos):
+        # whether pos is in the visible blocks given by around, out of the level counts as visible
+        n, m = self.solid.shape
+        x, z = floor(pos.x), floor(pos.z)
+        return not (0 <= x < m and 0 <= z < n) or visible[z*m + x]
+
+    def clear(self, x, z, targets, solid, x0, z0):
+        # whether some line from the block x, z to each of the targets (x, z) doesn't cross any solid block
+        # solid: the blocks of the level from x0, z0, around all the lines
+        w = solid.shape[1]
+        start = self.samples + (x, z) # (samples, 2)
+        ends = targets[:, None] + self.samples # (targets, samples, 2)
+        length = np.abs(ends[:, None] - start[:, None]).max()
+        t = np.linspace(0, 1, ceil(length/STEP)+2)
+
+        # (targets, start samples, end samples, steps, 2), always inside of the level as both ends are
+        points = start[None, :, None, None] + (ends[:, None, :, None]-start[None, :, None, None])*t[:, None]
+        blocks = (np.floor(points[..., 1]).astype(int)-z0)*w + np.floor(points[..., 0]).astype(int)-x0
+        return ~solid.ravel()[blocks].any(3).all((1, 2))
+
+    def compute(self, x, z):
+        # only in the window of the blocks in range and the walls around them, whatever the size of the level
+        r = self.distance+2
+        x0, z0 = max(x-r, 0), max(z-r, 0)
+        solid = self.solid[z0:z+r+1, x0:x+r+1]
+        h, w = solid.shape
+        visible = np.zeros((h, w), bool)
+        frontier = np.zeros((h, w), bool)
+        near = np.zeros((h, w), bool)
+        visible[z-z0, x-x0] = frontier[z-z0, x-x0] = True
+        zs, xs = np.ogrid[z0:z0+h, x0:x0+w]
+        untested = ~solid & ((xs-x)**2 + (zs-z)**2 <= (self.distance+1)**2) # air blocks in range
+        untested[z-z0, x-x0] = False
+
+        # grow through the portals, one ring of neighbors at a time
+        while frontier.any():
+            near[:] = False
+            near[:-1] |= frontier[1:]
+            near[1:] |= frontier[:-1]
+            near[:, :-1] |= frontier[:, 1:]
+            near[:, 1:] |= frontier[:, :-1]
+            near &= untested
+            untested &= ~near
+            z_, x_ = np.nonzero(near)
+            frontier[:] = False
+            if len(z_):
+                seen = self.clear(x, z, np.stack([x_+x0, z_+z0], 1), solid, x0, z0)
+                frontier[z_[seen], x_[seen]] = True
+            visible |= frontier
+
+        # the walls around the visible blocks, and a margin for the lines between the samples
+        padded = np.pad(visible, 1)
+        visible = padded[1:-1, 1:-1].copy()
+        for dz in range(3):
+            for dx in range(3):
+                visible |= padded[dz:dz+h, dx:dx+w]
+
+        z_, x_ = np.nonzero(visible)
+        box = visible[z_.min():z_.max()+1, x_.min():x_.max()+1]
+        return x0+x_.min(), z0+z_.min(), box.shape[1], box.shape[0], np.packbits(box)
@@ -0,0 +1,83 @@
+class Quality:
+    # holds a target frame time by lowering or raising the settings one step at a time
+    # the settings are lowered in order (the least visible first), the frame time every step bought is measured
+    # and a setting is raised back when what it costs fits under the target
+    def __init__(self, knobs, target=None, log=None, window=1000, low=0.7, high=0.9, patience=3):
+        # knobs: [(name, values from the best to the worst)], target: frame time (ms), None to keep the best values
+        # window: time (ms) of the frames averaged for every decision
+        # high: fraction of the target to stay under when raising a setting, after patience windows in a row
+        # low: the same for the settings whose cost is not known yet
+        self.knobs = dict(knobs)
+        self.order = [name for name, _ in knobs]
+        self.levels = {name: 0 for name in self.order}
+        self.target, self.log = target, log
+        self.window, self.low, self.high, self.patience = window, low, high, patience
+
+        self.time = 0 # since the start (ms)
+        self.frames = [] # work time of the frames of the current window
+        self.elapsed = 0 # time of the current window
+        self.calm = 0 # windows in a row under the target
+        self.lowered = [] # names of the lowered settings, the last one at the end
+        self.costs = {} # frame time (ms) of the last step of every setting, when measured
+        self.pending = None # [name, old value, new value, frame time before, step]: measured in the next window
+        self.waits = {name: patience for name in self.order} # windows to wait before raising every setting
+
+    def __getitem__(self, name):
+        return self.knobs[name][self.levels[name]]
+
+    def reset(self):
+        # forget the current window, after frames that don't tell anything (loading)
+        self.frames, self.elapsed = [], 0
+
+    def frame(self, work, time_passed):
+        # work: time spent on the last frame, not waiting (ms), time_passed: frame time (ms)
+        # returns whether a setting changed
+        self.time += time_passed
+        if self.target is None:
+            return False
+        self.frames.append(work)
+        self.elapsed += time_passed
+        if self.elapsed < self.window:
+            return False
+        average = sum(self.frames) / len(self.frames)
+        self.reset()
+
+        if self.pending is not None: # what the last change did
+            name, old, new, before, step = self.pending
+            self.write('%s %s -> %s: %.2f -> %.2f ms' %(name, old, new, before, average))
+            self.pending = None
+            self.costs[name] = max((before-average)*step, 0)
+            if step < 0 and average > self.target:
+                self.waits[name] *= 2 # raised too early: wait longer next time
+
+        if average > self.target: # too slow
+            self.calm = 0
+            for name in self.order:
+                if self.levels[name] < len(self.knobs[name])-1:
+                    self.change(name, 1, average)
+                    self.lowered.append(name)
+                    return True
+
+        elif self.lowered: # maybe fast enough to look better, the last lowered settings first
+            self.calm += 1
+            for index in range(len(self.lowered)-1, -1, -1):
+                name = self.lowered[index]
+                cost = self.costs.get(name, self.target*(self.high-self.low))
+                if self.calm >= self.waits[name] and average+cost <= self.target*self.high:
+                    self.calm = 0
+                    del self.lowered[index]
+                    self.change(name, -1, average)
+                    return True
+        return False
+
+    def change(self, name, step, average):
+        old = self[name]
+        self.levels[name] += step
+        self.pending = [name, old, self[name], average, step]
+        self.write('%s %s %s -> %s (%.2f ms for %.2f ms)'
+                   %(['raise', 'lower'][step > 0], name, old, self[name], average, self.target))
+
+    def write(self, line):
+        if self.log is not None:
+            self.log.write('%8.1f s  %s\n' %(self.time/1000, line))
+            self.log.flush()
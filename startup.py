@@ -0,0 +1,57 @@
+from time import perf_counter
+from threading import Thread, current_thread, main_thread
+from concurrent.futures import Future
+
+def where():
+    return 'main' if current_thread() is main_thread() else 'worker'
+
+class Startup:
+    # everything done before the first frame, as stages that run as soon as the stages they need are done
+    # every stage is either started on its own thread (add) or run on this thread (run: the ones using OpenGL)
+    def __init__(self):
+        self.start = perf_counter()
+        self.futures = {} # name: result of the stage
+        self.times = {} # name: [where, start, end] (s since the start), end is None while running
+
+    def add(self, name, function, *needs):
+        # start function on a thread once the needs are done, called with their results
+        self.futures[name] = Future()
+        Thread(target=self.stage, args=(name, function, needs), daemon=True).start() # never waited for when quitting
+
+    def run(self, name, function, *needs):
+        # the same on this thread, waits for the needs and returns the result
+        self.futures[name] = Future()
+        self.stage(name, function, needs)
+        return self.result(name)
+
+    def stage(self, name, function, needs):
+        try:
+            args = [self.result(need) for need in needs]
+            self.times[name] = [where(), perf_counter()-self.start, None]
+            result = function(*args)
+        except BaseException as e: # given to whatever needs the result
+            self.end(name)
+            self.futures[name].set_exception(e)
+        else:
+            self.end(name)
+            self.futures[name].set_result(result)
+
+    def end(self, name):
+        if name in self.times: # else one of the needs failed
+            self.times[name][2] = perf_counter()-self.start
+
+    def result(self, name):
+        return self.futures[name].result()
+
+    def mark(self, name):
+        # something that happened now, for the report
+        now = perf_counter()-self.start
+        self.times[name] = [where(), now, now]
+
+    def report(self):
+        # lines of a table of the stages, in the order they started
+        lines = ['%-12s %-8s %10s %10s' %('startup', 'thread', 'start (ms)', 'time (ms)')]
+        for name, (thread, start, end) in sorted(self.times.items(), key=lambda item: item[1][1]):
+            time = 'running' if end is None else '%.1f' %((end-start)*1000)
+            lines.append('%-12s %-8s %10.1f %10s' %(name, thread, start*1000, time))
+        return lines
@@ -0,0 +1,52 @@
+import mmap
+import struct
+import numpy as np
+
+PACK = 'files/textures.pack' # built by build_pack.py
+MAGIC = b'MAZETEX1'
+
+# file layout: magic, size of the index, index, then the RGBA data of every image (from the bottom line)
+# every line of the index is "path width height offset", offsets counting from the start of the data
+
+def align(x):
+    return (x+15) // 16 * 16
+
+def write(images, path=PACK):
+    # images: {path: [w, h, RGBA data from the bottom line]}
+    index, offsets, offset = [], [], 0
+    for name, (w, h, _) in images.items():
+        index.append('%s %d %d %d' %(name, w, h, offset))
+        offsets.append(offset)
+        offset = align(offset + w*h*4)
+    index = '\n'.join(index).encode()
+
+    start = align(12+len(index))
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<8sI', MAGIC, len(index)) + index)
+        for (_, _, data), offset in zip(images.values(), offsets):
+            f.seek(start+offset)
+            f.write(data)
+
+class TexturePack:
+    # images of a pack, read straight from the file mapped in memory
+    def __init__(self, path=PACK):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, size = struct.unpack_from('<8sI', self.map)
+        if magic != MAGIC:
+            raise ValueError('%s is not a texture pack' %path)
+
+        start = align(12+size)
+        self.index = {}
+        for line in self.map[12:12+size].decode().split('\n'):
+            name, w, h, offset = line.rsplit(' ', 3)
+            self.index[name] = (int(w), int(h), start+int(offset))
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name):
+        # [w, h, RGBA data from the bottom line], without copy
+        w, h, offset = self.index[name]
+        return [w, h, np.frombuffer(self.map, np.uint8, w*h*4, offset)]